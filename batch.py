@@ -0,0 +1,166 @@
+import argparse
+import functools
+import glob
+import hashlib
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import checkpoint
+import rules_2x2
+from loader import iter_named_specs
+from main import DEFAULT_MAX_CHECKS, Puzzle
+
+
+class SolveTimeout(Exception):
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise SolveTimeout()
+
+
+# expand every argument into puzzle files: directories are searched for .txt files, anything else is a glob
+def find_puzzle_files(patterns):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, '*.txt'))))
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+    return paths
+
+
+def solution_status(puzzle):
+    if puzzle.empty_bits():
+        return 'unsolved'
+    if puzzle.check_solution_validity():
+        return 'valid'
+    return 'invalid'
+
+
+# every puzzle in the files as (name, spec), see loader.iter_named_specs
+def find_puzzles(patterns):
+    for path in find_puzzle_files(patterns):
+        yield from iter_named_specs(path)
+
+
+# the file for a puzzle in directory, named after a hash of its absolute path and number so puzzles with the same
+# file name in different directories, or different puzzles of one list, never share a file
+def puzzle_file_path(directory, name, extension):
+    digest = hashlib.sha256(os.path.abspath(name).encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return os.path.join(directory, f'{stem}-{digest}{extension}')
+
+
+# solve one puzzle without any interaction, returning (name, status, steps, seconds, solution).
+# spec is (section_map, stars, state) or the exception raised reading it, as yielded by find_puzzles.
+# with a checkpoint_dir the solve is saved there as it goes and picks up from that file when run again,
+# the file is removed once the puzzle is finished
+def solve_spec(name, spec, timeout=None, max_level=None, trace_dir=None, deterministic=False, checkpoint_dir=None,
+               checkpoint_interval=checkpoint.DEFAULT_INTERVAL, max_guesses=None, max_nodes=None,
+               max_checks=DEFAULT_MAX_CHECKS):
+    start = time.perf_counter()
+    puzzle = None
+    status = 'error'
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.alarm(timeout)
+    checkpoint_path = None
+    resume = None
+    if checkpoint_dir:
+        checkpoint_path = puzzle_file_path(checkpoint_dir, name, '.checkpoint')
+    try:
+        if isinstance(spec, Exception):
+            raise spec
+        section_map, stars, state = spec
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            try:
+                puzzle, resume = checkpoint.load(checkpoint_path, section_map, stars)
+            except ValueError:
+                # an old or unreadable checkpoint, or one of a puzzle that has since changed: start over
+                puzzle = None
+        if puzzle is None:
+            puzzle = Puzzle(section_map, state, stars)
+        puzzle.out = None
+        options = dict(interactive=False, max_level=max_level, max_guesses=max_guesses, max_nodes=max_nodes,
+                       max_checks=max_checks, deterministic=deterministic, checkpoint_path=checkpoint_path,
+                       checkpoint_interval=checkpoint_interval, resume=resume)
+        if trace_dir:
+            trace_path = puzzle_file_path(trace_dir, name, '.jsonl')
+            with open(trace_path, 'a' if resume else 'w') as trace:
+                puzzle.solve(trace=trace, **options)
+        else:
+            puzzle.solve(**options)
+        status = solution_status(puzzle)
+        if checkpoint_path is not None and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+    except SolveTimeout:
+        status = 'timeout'
+    except Exception as e:
+        status = f'error:{type(e).__name__}'
+    finally:
+        if timeout:
+            signal.alarm(0)
+    elapsed = time.perf_counter() - start
+
+    if puzzle is None:
+        return name, status, 0, elapsed, ''
+    return name, status, getattr(puzzle, 'steps', 0), elapsed, puzzle.state_string().replace('\n', '/')
+
+
+def init_worker(cover_cache_path):
+    if cover_cache_path:
+        rules_2x2.cache_2x2.load(cover_cache_path)
+
+
+def format_result(result):
+    path, status, steps, elapsed, solution = result
+    return f'{path}\t{status}\t{steps}\t{elapsed:.3f}\t{solution}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve many puzzle files without interaction.')
+    parser.add_argument('paths', nargs='+', help='puzzle files, directories or glob patterns')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-o', '--output', help='file to write result lines to (default: stdout)')
+    parser.add_argument('-t', '--timeout', type=int, default=None, help='seconds allowed per puzzle')
+    parser.add_argument('-l', '--max-level', type=int, default=None,
+                        help='highest multi-group exclusion level to try before searching')
+    parser.add_argument('--max-guesses', type=int, default=None,
+                        help='next best groups to add while the board stays the same before searching (default: 1)')
+    parser.add_argument('--max-checks', type=int, default=DEFAULT_MAX_CHECKS,
+                        help='exclusion checks in one step before searching instead, 0 for no limit')
+    parser.add_argument('--max-nodes', type=int, default=None, help='give up on the fallback search after this many nodes')
+    parser.add_argument('--cover-cache', help='precomputed 2x2 cover cache file to load in every worker')
+    parser.add_argument('--trace-dir', help='write a JSON lines trace of every solve to this directory')
+    parser.add_argument('-d', '--deterministic', action='store_true',
+                        help='run the rules in a fixed order instead of by measured cost per deduction')
+    parser.add_argument('--checkpoint-dir', help='save solves in progress to this directory and resume from it')
+    parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.DEFAULT_INTERVAL,
+                        help='seconds between checkpoints')
+    args = parser.parse_args(argv)
+
+    puzzles = list(find_puzzles(args.paths))
+    names = [name for name, _ in puzzles]
+    specs = [spec for _, spec in puzzles]
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker,
+                                 initargs=(args.cover_cache,)) as executor:
+            solve = functools.partial(
+                solve_spec, timeout=args.timeout, max_level=args.max_level, trace_dir=args.trace_dir,
+                deterministic=args.deterministic, checkpoint_dir=args.checkpoint_dir,
+                checkpoint_interval=args.checkpoint_interval, max_guesses=args.max_guesses, max_nodes=args.max_nodes,
+                max_checks=args.max_checks or None)
+            for result in executor.map(solve, names, specs):
+                print(format_result(result), file=out, flush=True)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import contextlib
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import rules_2x2
+from batch import find_puzzles, solution_status
+from chain_reactions import SHORT_CHAIN
+from main import Puzzle
+
+# slowdowns smaller than this many seconds are timer noise, not regressions
+MIN_TIME_DELTA = 0.005
+
+
+# spec is (section_map, stars, state), executor is an optional process pool the chains and exclusions are searched on
+def solve_quietly(spec, max_level, deterministic=False, executor=None, early_exit=False):
+    section_map, stars, state = spec
+    puzzle = Puzzle(section_map, state, stars)
+    puzzle.out = None
+    puzzle.solve(interactive=False, max_level=max_level, deterministic=deterministic, executor=executor,
+                 early_exit=early_exit)
+    return puzzle
+
+
+# solve one puzzle `repeat` times for timing plus once more under tracemalloc for its peak memory
+def benchmark_puzzle(spec, repeat, max_level, cold, deterministic=False, executor=None, early_exit=False):
+    times = []
+    puzzle = None
+    for _ in range(repeat):
+        if cold:
+            rules_2x2.cache_2x2.clear()
+        start = time.perf_counter()
+        puzzle = solve_quietly(spec, max_level, deterministic, executor, early_exit)
+        times.append(time.perf_counter() - start)
+
+    if cold:
+        rules_2x2.cache_2x2.clear()
+    tracemalloc.start()
+    solve_quietly(spec, max_level, deterministic, executor, early_exit)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'status': solution_status(puzzle),
+        'min_time': min(times),
+        'median_time': statistics.median(times),
+        'times': times,
+        'peak_memory': peak_memory,
+        **puzzle.stats.to_dict(),
+    }
+
+
+# return a list of messages about puzzles that got slower by more than `threshold` times, or changed result
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if result['status'] != old['status']:
+            regressions.append(f'{name}: status {old["status"]} -> {result["status"]}')
+        # a puzzle that couldn't be read has nothing else to compare
+        if 'min_time' not in result or 'min_time' not in old:
+            continue
+        slower = result['min_time'] - old['min_time']
+        if result['min_time'] > old['min_time'] * threshold and slower > MIN_TIME_DELTA:
+            regressions.append(f'{name}: time {old["min_time"]:.3f}s -> {result["min_time"]:.3f}s')
+        if result['checks'] > old['checks'] * threshold:
+            regressions.append(f'{name}: checks {old["checks"]} -> {result["checks"]}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the solver on a corpus of puzzle files.')
+    parser.add_argument('paths', nargs='*', default=['puzzles'], help='puzzle files, directories or glob patterns')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timed runs per puzzle')
+    parser.add_argument('-l', '--max-level', type=int, default=None,
+                        help='highest multi-group exclusion level to try before searching')
+    parser.add_argument('--cold', action='store_true', help='clear the 2x2 cache before every run')
+    parser.add_argument('-d', '--deterministic', action='store_true',
+                        help='run the rules in a fixed order instead of by measured cost per deduction')
+    parser.add_argument('--probe-jobs', type=int, default=0,
+                        help='worker processes probing chains and searching exclusions in parallel (0 for none)')
+    parser.add_argument('--early-exit', action='store_true',
+                        help=f'take the first chain of at most {SHORT_CHAIN} steps instead of the shortest one')
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    parser.add_argument('-b', '--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression when comparing')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with ProcessPoolExecutor(args.probe_jobs) if args.probe_jobs else contextlib.nullcontext() as executor:
+        for name, spec in find_puzzles(args.paths):
+            if isinstance(spec, Exception):
+                results[name] = {'status': f'error:{type(spec).__name__}'}
+                print(f'{name}: error:{type(spec).__name__}: {spec}')
+                continue
+            result = benchmark_puzzle(spec, args.repeat, args.max_level, args.cold, args.deterministic, executor,
+                                      args.early_exit)
+            results[name] = result
+            rules = ' '.join(
+                f'{rule}={stats["hits"]}/{stats["calls"]}:{stats["time"]:.3f}s'
+                for rule, stats in sorted(result['rules'].items())
+            )
+            print(f'{name}: {result["status"]} {result["min_time"]:.3f}s (median {result["median_time"]:.3f}s) '
+                  f'{result["steps"]} steps, {result["checks"]} checks, {result["cache_hit_rate"]:.1%} cache hits, '
+                  f'{result["peak_memory"] / 1024:.0f} KiB peak, {rules}')
+
+    total = sum(result.get('min_time', 0) for result in results.values())
+    print(f'{len(results)} puzzles in {total:.3f}s')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'repeat': args.repeat,
+                'max_level': args.max_level,
+                'cold': args.cold,
+                'deterministic': args.deterministic,
+                'puzzles': results,
+            }, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['puzzles']
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
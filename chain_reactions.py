@@ -1,40 +1,80 @@
-import rules_2x2
-from group import Group
-
-def test_for_chain(puzzle, tile):
-    p = puzzle.copy()
-    p.groups.append(
-        Group({p.board[tile.row][tile.col]}, 1)
-    )
-
-    length = 0
-    while True:
-        length += 1
-        if not p.check_validity()[0]:
-            p.pretty_print()
-            return length
-
-        num_solved = len(p.place_star_solved_groups())
-        if num_solved > 0:
-            continue
-
-        #clobbering = list(rules_2x2.find_all_2x2_clobbering(p))
-        #if len(clobbering) > 0:
-        #    p.eliminate_tiles(clobbering)
-        #    continue
-
-        return -1
-
-def apply_chains(puzzle):
-    solutions = []
-    for row in puzzle.board:
-        for tile in row:
-            if not tile.empty():
-                continue
-            if (length := test_for_chain(puzzle, tile)) != -1:
-                solutions.append((length, tile))
-    if len(solutions) > 0:
-        _, tile = min(solutions, key=lambda s: s[0])
-        puzzle.eliminate_tiles([tile])
-        return True
-    return False
\ No newline at end of file
+from concurrent.futures import as_completed
+
+import propagation
+import utils
+from group import Group
+
+# tiles sent to a worker at a time when probing in parallel
+CHUNK_SIZE = 8
+# chains this short are taken immediately in early exit mode
+SHORT_CHAIN = 2
+
+# assume a star on the tile and propagate, returning the number of stars placed up to a contradiction or -1.
+# the puzzle is left unchanged
+def test_for_chain(puzzle, tile):
+    p = puzzle
+    mark = p.push()
+    try:
+        p.add_group(
+            Group(tile.bit, 1)
+        )
+
+        try:
+            propagation.propagate(p, tile.bit)
+        except propagation.Contradiction as e:
+            p.pretty_print()
+            return e.placed.bit_count() + 1
+        return -1
+    finally:
+        p.rollback(mark)
+
+# probe the given tiles of a puzzle packed by Puzzle.to_bytes in a worker process, returning a list of (length, index)
+def probe_tiles(state, indices, early_exit=False):
+    from main import Puzzle
+    puzzle = Puzzle.from_bytes(state)
+    puzzle.out = None
+    ans = []
+    for index in indices:
+        if (length := test_for_chain(puzzle, puzzle.tiles[index])) != -1:
+            ans.append((length, index))
+            if early_exit and length <= SHORT_CHAIN:
+                break
+    return ans
+
+def find_chains(puzzle, early_exit=False):
+    solutions = []
+    for index in utils.iter_bits(puzzle.empty_bits()):
+        if (length := test_for_chain(puzzle, puzzle.tiles[index])) != -1:
+            solutions.append((length, index))
+            if early_exit and length <= SHORT_CHAIN:
+                break
+    return solutions
+
+def find_chains_parallel(puzzle, executor, early_exit=False):
+    state = puzzle.to_bytes()
+    indices = list(utils.iter_bits(puzzle.empty_bits()))
+    futures = [
+        executor.submit(probe_tiles, state, indices[i:i + CHUNK_SIZE], early_exit)
+        for i in range(0, len(indices), CHUNK_SIZE)
+    ]
+    solutions = []
+    for future in as_completed(futures):
+        solutions.extend(future.result())
+        if early_exit and any(length <= SHORT_CHAIN for length, _ in solutions):
+            for f in futures:
+                f.cancel()
+            break
+    return solutions
+
+# eliminate the tile whose star leads to the shortest contradiction.
+# with an executor the tiles are probed in parallel, early_exit takes the first short enough chain
+def apply_chains(puzzle, executor=None, early_exit=False):
+    if executor is None:
+        solutions = find_chains(puzzle, early_exit)
+    else:
+        solutions = find_chains_parallel(puzzle, executor, early_exit)
+    if len(solutions) > 0:
+        _, index = min(solutions)
+        puzzle.eliminate_tiles(puzzle.tiles[index].bit)
+        return True
+    return False
@@ -0,0 +1,42 @@
+import json
+import os
+
+from group import DEFAULT_REGISTRY_SIZE, GroupRegistry
+
+VERSION = 2
+# seconds between the checkpoints written by a solve
+DEFAULT_INTERVAL = 60
+
+
+# write everything a solve needs to carry on to path: the puzzle's section map and stars, the board and live groups
+# packed by Puzzle.to_bytes, the known groups and the progress dict from the solver. the file is replaced in one go,
+# so a worker killed while saving leaves the previous checkpoint behind
+def save(path, puzzle, progress):
+    data = {
+        'version': VERSION,
+        'section_map': puzzle.section_string(),
+        'stars': puzzle.stars,
+        'state': puzzle.to_bytes().hex(),
+        'known': [[bits, stars] for bits, stars in puzzle.known_groups],
+        'progress': progress,
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(temp_path, path)
+
+
+# read a checkpoint written by save, returns (puzzle, progress) ready for puzzle.solve(resume=progress).
+# with a section_map and stars, a checkpoint of any other puzzle raises ValueError
+def load(path, section_map=None, stars=None):
+    from main import Puzzle
+    with open(path) as file:
+        data = json.load(file)
+    if data.get('version') != VERSION:
+        raise ValueError(f'{path} is not a version {VERSION} checkpoint')
+    if section_map is not None and (data['section_map'] != section_map or data['stars'] != stars):
+        raise ValueError(f'{path} is a checkpoint of another puzzle')
+    puzzle = Puzzle.from_bytes(bytes.fromhex(data['state']))
+    known = [tuple(key) for key in data['known']]
+    puzzle.known_groups = GroupRegistry(known, max(len(known), DEFAULT_REGISTRY_SIZE))
+    return puzzle, data['progress']
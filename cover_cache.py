@@ -0,0 +1,151 @@
+import argparse
+import mmap
+import os
+import struct
+from collections import OrderedDict
+
+MAGIC = b'SB2X'
+VERSION = 2
+HEADER = struct.Struct('<4sBI')
+RECORD = struct.Struct('<BBBH')
+DEFAULT_MAX_SIZE = 1 << 16
+DEFAULT_RECENT_SIZE = 1 << 14
+
+
+# translate a mask on a board of the given size to the top left corner of its bounding box.
+# returns (height, width, bits) where bits uses the box width as its row stride
+def normalize(bits, size):
+    if bits == 0:
+        return 0, 0, 0
+    low = (bits & -bits).bit_length() - 1
+    high = bits.bit_length() - 1
+    first_row = low // size
+    height = high // size - first_row + 1
+    row_mask = (1 << size) - 1
+    rows = bits >> (first_row * size)
+    fold = 0
+    for r in range(height):
+        fold |= (rows >> (r * size)) & row_mask
+    first_col = (fold & -fold).bit_length() - 1
+    width = fold.bit_length() - first_col
+    box_mask = (1 << width) - 1
+    ans = 0
+    for r in range(height):
+        ans |= ((rows >> (r * size + first_col)) & box_mask) << (r * width)
+    return height, width, ans
+
+
+# bounded LRU cache from normalized masks to a small int.
+# lookups by raw mask go through a small table that is emptied when full, so repeated masks skip normalize
+class CoverCache:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, recent_size=DEFAULT_RECENT_SIZE):
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        self.recent = {}
+        self.recent_size = recent_size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        ans = self.entries.get(key)
+        if ans is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return ans
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    # return the value for a mask on a board of the given size, compute(bits, width) fills in misses
+    def lookup(self, bits, size, compute):
+        raw = (bits, size)
+        ans = self.recent.get(raw)
+        if ans is not None:
+            self.hits += 1
+            return ans
+        key = normalize(bits, size)
+        ans = self.get(key)
+        if ans is None:
+            height, width, normalized = key
+            ans = compute(normalized, width)
+            self.put(key, ans)
+        if len(self.recent) >= self.recent_size:
+            self.recent.clear()
+        self.recent[raw] = ans
+        return ans
+
+    def clear(self):
+        self.entries.clear()
+        self.recent.clear()
+        self.hits = 0
+        self.misses = 0
+
+    # fill in every shape whose bounding box fits in max_side x max_side, compute(bits, width) gives the value
+    def seed(self, compute, max_side):
+        for height in range(1, max_side + 1):
+            for width in range(1, max_side + 1):
+                cells = height * width
+                first_col = 0
+                for r in range(height):
+                    first_col |= 1 << (r * width)
+                last_col = first_col << (width - 1)
+                top_row = (1 << width) - 1
+                bottom_row = top_row << ((height - 1) * width)
+                for bits in range(1, 1 << cells):
+                    # only shapes touching all four sides of the box are normalized
+                    if bits & top_row and bits & bottom_row and bits & first_col and bits & last_col:
+                        key = (height, width, bits)
+                        if key not in self.entries:
+                            self.put(key, compute(bits, width))
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, len(self.entries)))
+            for (height, width, bits), value in self.entries.items():
+                data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+                file.write(RECORD.pack(height, width, value, len(data)))
+                file.write(data)
+
+    # add the entries of a file written by save, oldest first so the newest survive eviction
+    def load(self, path):
+        if os.path.getsize(path) < HEADER.size:
+            return
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version, count = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'{path} is not a 2x2 cover cache file')
+            offset = HEADER.size
+            for _ in range(count):
+                height, width, value, length = RECORD.unpack_from(data, offset)
+                offset += RECORD.size
+                bits = int.from_bytes(data[offset:offset + length], 'little')
+                offset += length
+                self.put((height, width, bits), value)
+
+
+def main():
+    import rules_2x2
+    parser = argparse.ArgumentParser(description='Build a precomputed 2x2 cover cache file.')
+    parser.add_argument('path', help='file to write')
+    parser.add_argument('--max-side', type=int, default=4, help='seed every shape up to this bounding box')
+    args = parser.parse_args()
+
+    cache = CoverCache(max_size=1 << 20)
+    cache.seed(rules_2x2.max_stars, args.max_side)
+    cache.save(args.path)
+    print(f'{len(cache)} shapes written to {args.path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import os
+import random
+import string
+
+import search
+import utils
+from main import Puzzle
+
+# restarts allowed when building a solution or merging regions before giving up on a seed
+MAX_RESTARTS = 1000
+
+
+# a random valid star placement: `stars` stars in every row and column, none touching, found by the solution search
+# with random branching. returns a list of column masks, one per row, or None if it took more than max_nodes
+def random_solution(size, stars, rng, max_nodes=1000):
+    rows = utils.row_masks(size)
+    cols = utils.col_masks(size)
+    groups = [(bits, stars) for bits in rows + cols]
+    # pairs of neighbouring rows and columns are implied groups, the 2x2 count on them prunes hard on big boards
+    groups += [(rows[i] | rows[i + 1], 2 * stars) for i in range(size - 1)]
+    groups += [(cols[i] | cols[i + 1], 2 * stars) for i in range(size - 1)]
+    neighbours = utils.neighbour_masks(size)
+    nodes = 0
+
+    def dfs(candidates, placed, dirty):
+        nonlocal nodes
+        nodes += 1
+        if nodes > max_nodes:
+            raise search.SearchLimitReached()
+        result = search.propagate(groups, neighbours, candidates, placed, size, dirty)
+        if result is None:
+            return None
+        candidates, placed = result
+        free = search.most_constrained(groups, candidates, placed)
+        if free == 0:
+            return placed
+        index = rng.choice(list(utils.iter_bits(free)))
+        bit = 1 << index
+        ans = dfs(candidates & ~(bit | neighbours[index]), placed | bit, bit | neighbours[index])
+        if ans is not None:
+            return ans
+        return dfs(candidates & ~bit, placed, bit)
+
+    try:
+        placed = dfs((1 << (size * size)) - 1, 0, None)
+    except search.SearchLimitReached:
+        return None
+    if placed is None:
+        return None
+    row_mask = (1 << size) - 1
+    return [(placed >> (row * size)) & row_mask for row in range(size)]
+
+
+# grow a region around every star at random until the board is covered, returns the region number of every tile
+def grow_star_regions(size, solution, rng):
+    owner = [-1] * (size * size)
+    frontier = []
+    seeds = 0
+    for row, pattern in enumerate(solution):
+        for col in utils.iter_bits(pattern):
+            owner[row * size + col] = seeds
+            frontier.append(row * size + col)
+            seeds += 1
+    while frontier:
+        i = rng.randrange(len(frontier))
+        index = frontier[i]
+        row, col = divmod(index, size)
+        free = [
+            r * size + c for r, c in ((row - 1, col), (row + 1, col), (row, col - 1), (row, col + 1))
+            if 0 <= r < size and 0 <= c < size and owner[r * size + c] == -1
+        ]
+        if not free:
+            frontier[i] = frontier[-1]
+            frontier.pop()
+            continue
+        neighbour = rng.choice(free)
+        owner[neighbour] = owner[index]
+        frontier.append(neighbour)
+    return owner, seeds
+
+
+# merge the one star regions into connected regions of `stars` each, returns the new number of every old region
+# or None if the random merge got stuck
+def merge_regions(size, owner, seeds, stars, rng):
+    adjacent = [set() for _ in range(seeds)]
+    for index, region in enumerate(owner):
+        row, col = divmod(index, size)
+        if col + 1 < size and owner[index + 1] != region:
+            adjacent[region].add(owner[index + 1])
+            adjacent[owner[index + 1]].add(region)
+        if row + 1 < size and owner[index + size] != region:
+            adjacent[region].add(owner[index + size])
+            adjacent[owner[index + size]].add(region)
+
+    merged = [-1] * seeds
+    for number in range(seeds // stars):
+        left = [region for region in range(seeds) if merged[region] == -1]
+        # start from the most boxed in region so it doesn't get cut off
+        start = min(left, key=lambda region: (sum(merged[r] == -1 for r in adjacent[region]), rng.random()))
+        members = [start]
+        merged[start] = number
+        while len(members) < stars:
+            options = {r for m in members for r in adjacent[m] if merged[r] == -1}
+            if not options:
+                return None
+            # boxed in regions first here too, with ties broken at random
+            region = min(sorted(options), key=lambda r: (sum(merged[n] == -1 for n in adjacent[r]), rng.random()))
+            merged[region] = number
+            members.append(region)
+    return merged
+
+
+# a random section map of the given size where every region holds `stars` stars of a valid solution,
+# and that solution as a list of column masks
+def random_section_map(size, stars, rng):
+    if size > len(string.ascii_lowercase):
+        raise ValueError(f'at most {len(string.ascii_lowercase)} regions are supported')
+    for _ in range(MAX_RESTARTS):
+        solution = random_solution(size, stars, rng)
+        if solution is None:
+            continue
+        owner, seeds = grow_star_regions(size, solution, rng)
+        for _ in range(MAX_RESTARTS):
+            merged = merge_regions(size, owner, seeds, stars, rng)
+            if merged is not None:
+                letters = ''.join(string.ascii_lowercase[merged[region]] for region in owner)
+                return '\n'.join(letters[row * size:(row + 1) * size] for row in range(size)), solution
+    raise RuntimeError(f'no {size}x{size} {stars} star puzzle found in {MAX_RESTARTS} tries')
+
+
+# yield section maps, only ones with a single solution when unique is set.
+# max_nodes bounds the search for the uniqueness check, puzzles that hit it are skipped
+def generate(size, stars, rng, unique=False, max_nodes=None):
+    while True:
+        section_map, _ = random_section_map(size, stars, rng)
+        if unique:
+            solutions = search.count_solutions(Puzzle(section_map, None, stars), 2, max_nodes)
+            if solutions is None or len(solutions) != 1:
+                continue
+        yield section_map
+
+
+def format_puzzle(section_map, stars, puzzle_format):
+    if puzzle_format == 'original':
+        return f'original\n{stars}\n{section_map}\n'
+    if puzzle_format == 'online':
+        task = ','.join(str(ord(letter) - ord('a') + 1) for letter in section_map if letter != '\n')
+        return f'online\n{stars}\n{task}\n'
+    return f'{stars} {section_map.replace(chr(10), "")}\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate random puzzles.')
+    parser.add_argument('size', type=int, help='rows and columns')
+    parser.add_argument('stars', type=int, help='stars per row, column and region')
+    parser.add_argument('-n', '--count', type=int, default=1, help='number of puzzles')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='random seed')
+    parser.add_argument('-f', '--format', choices=['online', 'original', 'line'], default='line',
+                        help='puzzle file format, line writes a puzzle list')
+    parser.add_argument('-u', '--unique', action='store_true', help='only keep puzzles with a single solution')
+    parser.add_argument('--max-nodes', type=int, default=None, help='search limit for the uniqueness check')
+    parser.add_argument('-o', '--output', help='directory for online and original files, file for a puzzle list')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    puzzles = generate(args.size, args.stars, rng, args.unique, args.max_nodes)
+    if args.format == 'line':
+        out = open(args.output, 'w') if args.output else None
+        try:
+            for _ in range(args.count):
+                text = format_puzzle(next(puzzles), args.stars, args.format)
+                if out is None:
+                    print(text, end='', flush=True)
+                else:
+                    out.write(text)
+        finally:
+            if out is not None:
+                out.close()
+        return
+
+    directory = args.output or '.'
+    os.makedirs(directory, exist_ok=True)
+    for number in range(1, args.count + 1):
+        path = os.path.join(directory, f'{args.size}x{args.size}_{args.stars}_{number}.txt')
+        with open(path, 'w') as file:
+            file.write(format_puzzle(next(puzzles), args.stars, args.format))
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
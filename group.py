@@ -1,75 +1,91 @@
+from collections import OrderedDict
+
 import utils
 
+# groups a GroupRegistry remembers before forgetting the ones not seen for the longest
+DEFAULT_REGISTRY_SIZE = 1 << 14
+
+
 class Group:
-    def __init__(self, tiles, stars):
-        self.tiles = set(tiles)
+    # a group is a mask of empty tiles that must contain exactly `stars` more stars
+    def __init__(self, bits, stars):
+        self.bits = bits
         self.stars = stars
-        self.bits = utils.bits_from_tiles(self.tiles)
-
-    # true if this group is a subset of the given list of tiles
-    def is_subset(self, tiles):
-        for my_tile in self.tiles:
-            if my_tile not in tiles:
-                return False
-        return True
-
-    # return number of tiles in this group contained in the given collection of tiles
-    def get_overlap(self, tiles):
-        ans = 0
-        for my_tile in self.tiles:
-            if my_tile in tiles:
-                ans += 1
-        return ans
+
+    # true if this group is a subset of the given mask
+    def is_subset(self, bits):
+        return self.bits & ~bits == 0
+
+    # return number of tiles in this group contained in the given mask
+    def get_overlap(self, bits):
+        return (self.bits & bits).bit_count()
 
     def copy(self):
-        return Group({tile.copy() for tile in self.tiles}, self.stars)
+        return Group(self.bits, self.stars)
 
     def __eq__(self, other):
-        return self.tiles == other.tiles and self.stars == other.stars
+        return self.bits == other.bits and self.stars == other.stars
+
+    def remove(self, bits):
+        self.bits &= ~bits
 
-    def remove(self, tile):
-        try:
-            self.tiles.remove(tile)
-        except KeyError:
-            pass
-        self.bits &= ~tile.bit
+    def add(self, bits):
+        self.bits |= bits
 
-    def add(self, tile):
-        self.tiles.add(tile)
-        self.bits |= tile.bit
+    def __len__(self):
+        return self.bits.bit_count()
 
     def __hash__(self):
         return hash(self.bits)
 
     def __repr__(self):
-        return f'Group({self.tiles}, {self.stars})'
+        return f'Group({self.bits:#x}, {self.stars})'
 
     def empty(self):
-        return len(self.tiles) == 0 and self.stars == 0
+        return self.bits == 0 and self.stars == 0
 
     def contains(self, tile):
-        return tile in self.tiles
-
-    def is_row(self):
-        row = None
-        for tile in self.tiles:
-            if row is None:
-                row = tile.row
-            elif row != tile.row:
-                return False
-        return True
-
-    def is_col(self):
-        col = None
-        for tile in self.tiles:
-            if col is None:
-                col = tile.col
-            elif col != tile.col:
-                return False
-        return True
-
-    def row_number(self):
-        return next(iter(self.tiles)).row
-
-    def col_number(self):
-        return next(iter(self.tiles)).col
\ No newline at end of file
+        return self.bits & tile.bit != 0
+
+    def is_row(self, size):
+        if self.bits == 0:
+            return True
+        return self.bits & ~utils.row_masks(size)[self.row_number(size)] == 0
+
+    def is_col(self, size):
+        if self.bits == 0:
+            return True
+        return self.bits & ~utils.col_masks(size)[self.col_number(size)] == 0
+
+    def row_number(self, size):
+        return ((self.bits & -self.bits).bit_length() - 1) // size
+
+    def col_number(self, size):
+        return ((self.bits & -self.bits).bit_length() - 1) % size
+
+
+# the (bits, stars) of every group seen during a solve, so searches can skip deductions that are already known.
+# groups are stored once as plain keys, and the ones not added again for the longest are dropped past max_size
+class GroupRegistry:
+    def __init__(self, keys=(), max_size=DEFAULT_REGISTRY_SIZE):
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        for bits, stars in keys:
+            self.add(bits, stars)
+
+    def __len__(self):
+        return len(self.entries)
+
+    # yields (bits, stars), oldest first
+    def __iter__(self):
+        return iter(self.entries)
+
+    def known(self, bits, stars):
+        return (bits, stars) in self.entries
+
+    def add(self, bits, stars):
+        key = (bits, stars)
+        self.entries[key] = None
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,209 @@
+import argparse
+import math
+import mmap
+import os
+import string
+import struct
+
+from main import LETTER_REGIONS, REGION_LETTERS, Puzzle
+
+MAGIC = b'SBPZ'
+VERSION = 2
+HEADER = struct.Struct('<4sBI')
+# size, stars and whether the tiles are followed by the puzzle state, version 1 records have no state byte
+RECORD = struct.Struct('<BBB')
+RECORD_V1 = struct.Struct('<BB')
+STATE_VALUES = '.*x'
+
+
+# split a row-major string of section letters into the section map format accepted by Puzzle
+def section_map_from_letters(letters, size):
+    return '\n'.join(letters[row * size:(row + 1) * size] for row in range(size))
+
+
+# turn the "task" variable of star-battles.com, a comma-separated list of region numbers starting at 1,
+# into a section map
+def convert_task(task):
+    numbers = [int(num) for num in task.split(',')]
+    size = math.isqrt(len(numbers))
+    if size * size != len(numbers):
+        raise ValueError(f'{len(numbers)} region numbers do not make a square puzzle: {task!r}')
+    for num in numbers:
+        if not 1 <= num <= len(string.ascii_lowercase):
+            raise ValueError(f'region number {num} is not between 1 and {len(string.ascii_lowercase)}: {task!r}')
+    letters = ''.join(string.ascii_lowercase[num - 1] for num in numbers)
+    return section_map_from_letters(letters, size)
+
+
+# turn a partially solved grid of ., * and x, with rows separated by newlines or / or one after another,
+# into the puzzle_state format accepted by Puzzle
+def parse_state(text, size):
+    cells = ''.join(text.split()).replace('/', '')
+    if len(cells) != size * size or cells.strip(STATE_VALUES):
+        raise ValueError(f'a {size}x{size} puzzle state needs {size * size} tiles of {STATE_VALUES!r}, got {text!r}')
+    return section_map_from_letters(cells, size)
+
+
+# read a single puzzle file in the "online" or "original" format described in the README.
+# returns (section_map, stars, state), state is None when the file has no partially solved grid
+def read_puzzle_file(path):
+    with open(path) as puzzle_file:
+        puzzle_format = puzzle_file.readline().strip()
+        stars = int(puzzle_file.readline().strip())
+        if puzzle_format == 'online':
+            task = puzzle_file.readline().strip()
+            section_map = convert_task(task)
+        elif puzzle_format == 'original':
+            first = puzzle_file.readline().strip()
+            rows = [first] + [puzzle_file.readline().strip() for _ in range(len(first) - 1)]
+            section_map = '\n'.join(rows)
+        else:
+            raise ValueError(f'{path}: unknown puzzle format {puzzle_format!r}')
+        # a partially solved grid can follow the puzzle
+        rest = puzzle_file.read().strip()
+        state = parse_state(rest, section_map.count('\n') + 1) if rest else None
+        return section_map, stars, state
+
+
+def load_puzzle(path):
+    section_map, stars, state = read_puzzle_file(path)
+    return Puzzle(section_map, state, stars)
+
+
+# parse one line of a puzzle list: the number of stars, a space, either a star-battles.com task
+# or the section letters of every row one after another, then optionally a space and the puzzle state.
+# returns (section_map, stars, state)
+def parse_line(line):
+    stars, regions, *state = line.split()
+    if ',' in regions:
+        section_map = convert_task(regions)
+    else:
+        size = math.isqrt(len(regions))
+        if size * size != len(regions):
+            raise ValueError(f'{len(regions)} section letters do not make a square puzzle: {regions!r}')
+        section_map = section_map_from_letters(regions, size)
+    size = section_map.count('\n') + 1
+    return section_map, int(stars), parse_state(state[0], size) if state else None
+
+
+# yield every line of a file with one puzzle per line, blank lines and lines starting with # are skipped
+def iter_list_lines(path):
+    with open(path) as file:
+        for line in file:
+            if line.strip() and not line.startswith('#'):
+                yield line
+
+
+# yield (section_map, stars, state) for every puzzle of a file with one puzzle per line
+def iter_lines(path):
+    for line in iter_list_lines(path):
+        yield parse_line(line)
+
+
+# write (section_map, stars, state) in the binary format: a header with the number of puzzles, then
+# for every puzzle its size, stars, whether it has a state, one byte per tile with its region number
+# and, with a state, one more byte per tile with its ., * or x
+def write_binary(path, puzzles):
+    count = 0
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0))
+        for section_map, stars, state in puzzles:
+            rows = section_map.split('\n')
+            file.write(RECORD.pack(len(rows), stars, state is not None))
+            file.write(''.join(rows).encode().translate(LETTER_REGIONS))
+            if state is not None:
+                file.write(state.replace('\n', '').encode())
+            count += 1
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, count))
+    return count
+
+
+# yield (section_map, stars, state) for every puzzle of a file written by write_binary, old files included
+def iter_binary(path):
+    if os.path.getsize(path) < HEADER.size:
+        return
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError(f'{path} is not a binary puzzle file')
+        offset = HEADER.size
+        for _ in range(count):
+            if version == 1:
+                size, stars = RECORD_V1.unpack_from(data, offset)
+                has_state = False
+                offset += RECORD_V1.size
+            else:
+                size, stars, has_state = RECORD.unpack_from(data, offset)
+                offset += RECORD.size
+            cells = size * size
+            letters = data[offset:offset + cells].translate(REGION_LETTERS).decode()
+            offset += cells
+            state = None
+            if has_state:
+                state = section_map_from_letters(data[offset:offset + cells].decode(), size)
+                offset += cells
+            yield section_map_from_letters(letters, size), stars, state
+
+
+def is_binary(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+# whether the file holds a single puzzle in the "online" or "original" format
+def is_puzzle_file(path):
+    with open(path) as file:
+        return file.readline().strip() in ('online', 'original')
+
+
+# yield (section_map, stars, state) for every puzzle in a file of any of the formats above
+def iter_puzzle_specs(path):
+    if is_binary(path):
+        yield from iter_binary(path)
+    elif is_puzzle_file(path):
+        yield read_puzzle_file(path)
+    else:
+        yield from iter_lines(path)
+
+
+# yield (name, spec) for every puzzle in a file of any of the formats above. a single puzzle file is named by its path,
+# the n-th puzzle of a list or binary file by path:n. spec is (section_map, stars, state), or the exception raised
+# reading the puzzle, so a bad line of a list doesn't hide the puzzles after it
+def iter_named_specs(path):
+    try:
+        if is_binary(path):
+            for number, spec in enumerate(iter_binary(path), 1):
+                yield f'{path}:{number}', spec
+        elif is_puzzle_file(path):
+            yield path, read_puzzle_file(path)
+        else:
+            for number, line in enumerate(iter_list_lines(path), 1):
+                try:
+                    spec = parse_line(line)
+                except Exception as e:
+                    spec = e
+                yield f'{path}:{number}', spec
+    except Exception as e:
+        yield path, e
+
+
+# lazily yield a ready to solve Puzzle for every puzzle in the given files
+def iter_puzzles(*paths):
+    for path in paths:
+        for section_map, stars, state in iter_puzzle_specs(path):
+            yield Puzzle(section_map, state, stars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert puzzle files to the binary puzzle format.')
+    parser.add_argument('output', help='binary file to write')
+    parser.add_argument('paths', nargs='+', help='puzzle files in any supported format')
+    args = parser.parse_args()
+
+    count = write_binary(args.output, (spec for path in args.paths for spec in iter_puzzle_specs(path)))
+    print(f'{count} puzzles written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,211 +1,285 @@
 import itertools
-import math
 import string
-from collections import defaultdict
+import struct
+import sys
+import time
+from functools import lru_cache
+import checkpoint
 import multi_group_exclusion
+import pretty_print
+import propagation
 import rules_2x2
-from group import Group
+import search
+from group import Group, GroupRegistry
+from scheduler import Scheduler, StopSolve
+from stats import SolveStats
 
-# Colors & Symbols for grid
 import utils
-from chain_reactions import apply_chains
+from chain_reactions import SHORT_CHAIN, apply_chains
 from tile import Tile
 
-SECTION_BGS = [
-    40, 191, 218, 172, 63, 226, 45, 105, 249, 188
-]
-BLACK = 232
-WHITE = 196
-UNICODE_STAR = "★"
-UNICODE_DOT = "·"
-UNICODE_SQUARE = '■'
-
-# return a set of all tiles in all the groups passed
+# to_bytes layout: size, stars and number of groups, then one region number per tile,
+# the star and cross masks, and the mask and stars of every live group
+STATE_HEADER = struct.Struct('<BBH')
+GROUP_STARS = struct.Struct('<H')
+# section letters to region numbers and back
+LETTER_REGIONS = bytes.maketrans(string.ascii_lowercase.encode(), bytes(range(len(string.ascii_lowercase))))
+REGION_LETTERS = bytes.maketrans(bytes(range(len(string.ascii_lowercase))), string.ascii_lowercase.encode())
+# section maps whose tiles are kept around for new puzzles
+LAYOUT_CACHE_SIZE = 256
+# next best groups added while the board stays the same, and exclusion checks in one step, before searching
+DEFAULT_MAX_GUESSES = 1
+DEFAULT_MAX_CHECKS = 100000
+
+# return a mask of all tiles in all the groups passed
 def group_conjunction(groups):
-    tile_set = set()
-    first = True
-    if len(groups) == 1:
-        return set()
-    for group in groups:
-        if first:
-            tile_set = group.tiles.copy()
-            first = False
-        else:
-            tile_set &= group.tiles
-    return tile_set
+    if len(groups) <= 1:
+        return 0
+    bits = groups[0].bits
+    for group in groups[1:]:
+        bits &= group.bits
+    return bits
+
+# the tiles of a section map, returns (board, tiles, section_bits).
+# tiles never change, so every puzzle with the same section map shares them
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def board_layout(section_map):
+    rows = section_map.split('\n')
+    size = len(rows)
+    board = tuple(
+        tuple(Tile((row, col), rows[row][col], size) for col in range(size))
+        for row in range(size)
+    )
+    tiles = tuple(tile for row in board for tile in row)
+    section_bits = {}
+    for tile in tiles:
+        section_bits[tile.section] = section_bits.get(tile.section, 0) | tile.bit
+    return board, tiles, section_bits
+
+
+def mask_length(size):
+    return (size * size + 7) // 8
+
 
 class Puzzle:
     def __init__(self, section_map=None, puzzle_state=None, stars=None):
         if section_map is None:
             return
 
-        section_map = section_map.split('\n')
-        self.size = len(section_map)
+        self.board, self.tiles, self.section_bits = board_layout(section_map)
+        self.size = len(self.board)
         if puzzle_state is not None:
             puzzle_state = puzzle_state.split('\n')
         else:
             puzzle_state = ['.' * self.size for _ in range(self.size)]
 
-        self.board = [
-            [
-                Tile((row, col), section_map[row][col], puzzle_state[row][col], self.size)
-                for col in range(self.size)
-            ] for row in range(self.size)
-        ]
+        self.neighbours = utils.neighbour_masks(self.size)
+        self.full_bits = (1 << (self.size * self.size)) - 1
+        self.star_bits = 0
+        self.cross_bits = 0
+        for tile in self.tiles:
+            value = puzzle_state[tile.row][tile.col]
+            if value == '*':
+                self.star_bits |= tile.bit
+            elif value == 'x':
+                self.cross_bits |= tile.bit
         self.stars = stars
         self.groups = []
-        self.all_groups = set()
-
+        # for every tile, the live groups containing it
+        self.cell_groups = [[] for _ in range(self.size * self.size)]
+        # undo log of changes made since push(), None when nothing is being recorded
+        self.trail = None
+        # tiles of groups that got tighter since the last clobbering pass (new, shrunk or down to one star),
+        # and the empty tiles that pass found safe, so the next pass can skip tiles whose surroundings didn't change
+        self.changed_bits = self.full_bits
+        self.clobber_clean = 0
+        # every group seen so far, shared by copies of the puzzle
+        self.known_groups = GroupRegistry()
+        # where progress and boards are written, None for a silent solve
+        self.out = sys.stdout
+
+    # the row, column and section groups of the empty tiles, so a partially solved board starts where it left off
     def init_groups(self):
-        for row in range(self.size):
-            group = []
-            for col in range(self.size):
-                group.append(self.board[row][col])
-            self.groups.append(Group(group, self.stars))
-
-        for col in range(self.size):
-            group = []
-            for row in range(self.size):
-                group.append(self.board[row][col])
-            self.groups.append(Group(group, self.stars))
-
-        sections = defaultdict(list)
-        for row in self.board:
-            for tile in row:
-                sections[tile.section].append(tile)
-
-        for tiles in sections.values():
-            self.groups.append(Group(tiles, self.stars))
-
-        for group in self.groups:
-            print(group, group.bits)
+        empty_bits = self.empty_bits()
+        for bits in itertools.chain(utils.row_masks(self.size), utils.col_masks(self.size), self.section_bits.values()):
+            self.add_group(Group(bits & empty_bits, self.stars - self.star_count(bits)))
+
+        touching = 0
+        for index in utils.iter_bits(self.star_bits):
+            touching |= self.neighbours[index]
+        if touching & empty_bits:
+            self.eliminate_tiles(touching & empty_bits)
+
+        if self.out is not None:
+            for group in self.groups:
+                self.log(group, group.bits)
+
+    def empty_bits(self):
+        return self.full_bits & ~(self.star_bits | self.cross_bits)
+
+    def value(self, tile):
+        if self.star_bits & tile.bit:
+            return '*'
+        if self.cross_bits & tile.bit:
+            return 'x'
+        return '.'
+
+    # start recording changes so they can be undone, returns a mark to pass to rollback
+    def push(self):
+        if self.trail is None:
+            self.trail = []
+        mark = len(self.trail)
+        self.trail.append(('changed', self.changed_bits))
+        return mark
+
+    # undo every change made since the matching push
+    def rollback(self, mark):
+        trail = self.trail
+        while len(trail) > mark:
+            entry = trail.pop()
+            kind = entry[0]
+            if kind == 'group':
+                _, group, bits, stars = entry
+                group.bits = bits
+                group.stars = stars
+            elif kind == 'groups':
+                self.groups = entry[1]
+            elif kind == 'append':
+                del self.groups[entry[1]:]
+            elif kind == 'cell':
+                self.cell_groups[entry[1]] = entry[2]
+            elif kind == 'masks':
+                self.star_bits = entry[1]
+                self.cross_bits = entry[2]
+            elif kind == 'changed':
+                self.changed_bits = entry[1]
+        if mark == 0:
+            self.trail = None
+
+    def record(self, entry):
+        if self.trail is not None:
+            self.trail.append(entry)
+
+    def set_cell_groups(self, index, groups):
+        self.record(('cell', index, self.cell_groups[index]))
+        self.cell_groups[index] = groups
+
+    def set_groups(self, groups):
+        self.record(('groups', self.groups))
+        self.groups = groups
+
+    def set_masks(self, star_bits, cross_bits):
+        self.record(('masks', self.star_bits, self.cross_bits))
+        self.star_bits = star_bits
+        self.cross_bits = cross_bits
+
+    def add_group(self, group):
+        self.record(('append', len(self.groups)))
+        self.changed_bits |= group.bits
+        self.groups.append(group)
+        for index in utils.iter_bits(group.bits):
+            self.set_cell_groups(index, self.cell_groups[index] + [group])
+
+    # drop a group from the tile index, the caller takes care of self.groups
+    def unindex_group(self, group):
+        for index in utils.iter_bits(group.bits):
+            self.set_cell_groups(index, [g for g in self.cell_groups[index] if g is not group])
+
+    def remove_group(self, group):
+        self.unindex_group(group)
+        self.set_groups([g for g in self.groups if g is not group])
 
     def groups_containing_tile(self, tile):
-        for group in self.groups:
-            if group.contains(tile):
-                yield group
+        return iter(self.cell_groups[tile.index])
 
-    # return all tiles that would be made impossible if this tile were filled in with a star
+    # return a mask of all tiles that would be made impossible if this tile were filled in with a star
     def all_affected(self, tile):
-        # all surrounding:
-        ans = set()
-        for row_offset in range(-1, 2):
-            for col_offset in range(-1, 2):
-                row = tile.row + row_offset
-                col = tile.col + col_offset
-                if row_offset == 0 and col_offset == 0:
-                    continue
-                if row >= self.size or row < 0:
-                    continue
-                if col >= self.size or col < 0:
-                    continue
-
-                ans.add(self.board[row][col])
-
+        ans = self.neighbours[tile.index]
         for group in self.groups_containing_tile(tile):
             if group.stars == 1:
-                ans |= group.tiles
-
-        try:
-            ans.remove(tile)
-        except KeyError:
-            pass
-        return ans
+                ans |= group.bits
+        return ans & ~tile.bit
 
     def copy(self):
         puzzle = Puzzle()
-        puzzle.groups = [group.copy() for group in self.groups]
+        copies = {id(group): group.copy() for group in self.groups}
+        puzzle.groups = list(copies.values())
+        puzzle.cell_groups = [[copies[id(group)] for group in groups] for groups in self.cell_groups]
         puzzle.size = self.size
         puzzle.stars = self.stars
-        puzzle.board = [
-            [
-                self.board[row][col].copy()
-                for col in range(self.size)
-            ] for row in range(self.size)
-        ]
+        # tiles never change, so the board and the masks derived from it are shared
+        puzzle.board = self.board
+        puzzle.tiles = self.tiles
+        puzzle.neighbours = self.neighbours
+        puzzle.full_bits = self.full_bits
+        puzzle.section_bits = self.section_bits
+        puzzle.star_bits = self.star_bits
+        puzzle.cross_bits = self.cross_bits
+        puzzle.trail = None
+        puzzle.changed_bits = self.changed_bits
+        puzzle.clobber_clean = self.clobber_clean
+        puzzle.known_groups = self.known_groups
+        puzzle.out = self.out
         return puzzle
 
-    def print_groups(self, groups):
-        groups = list(groups)
-        print(' ' + string.ascii_lowercase[:self.size])
-        for row in range(self.size):
-            print((row + 1) % 10, end='')
-            for col in range(self.size):
-                text_color = WHITE
-                owner = None
-                for i in range(len(groups)):
-                    group = groups[i]
-                    if group.contains(self.board[row][col]):
-                        bg_color = SECTION_BGS[i % len(SECTION_BGS)]
-                        owner = group
-                        break
-                else:
-                    bg_color = BLACK
+    # write like print to the output sink, nothing is written when it is None
+    def log(self, *values, end='\n'):
+        if self.out is not None:
+            print(*values, end=end, file=self.out)
 
-                print(f'\033[48;5;{bg_color}m', end='')
-                print(f'\033[38;5;{text_color}m', end='')
-                print(owner.stars % 10 if owner else ' ', end='')
-            print('\033[0m')
+    def print_groups(self, groups):
+        if self.out is not None:
+            self.out.write(pretty_print.render_groups(self, groups))
 
     def pretty_print(self, old_puzzle=None):
-        print(' ' + string.ascii_lowercase[:self.size])
-        for row in range(self.size):
-            print((row + 1) % 10, end='')
-            for col in range(self.size):
-                section = self.board[row][col].section
-                bg_color = SECTION_BGS[(ord(section) - ord('a')) % len(SECTION_BGS)]
-                is_different = old_puzzle is not None and old_puzzle.board[row][col].value != self.board[row][col].value
-                if is_different:
-                    text_color = WHITE
-                else:
-                    text_color = BLACK
-
-                print(f'\033[48;5;{bg_color}m', end='')
-                print(f'\033[38;5;{text_color}m', end='')
-                if self.board[row][col].value == 'x':
-                    print(UNICODE_DOT, end='')
-                elif self.board[row][col].value == '*':
-                    print('&', end='')
-                else:
-                    # print(['x', 'o'][(row + col) % 2], end='')
-                    print(' ', end='')
-            print('\033[0m')
+        if self.out is not None:
+            self.out.write(pretty_print.render_board(self, old_puzzle))
+            self.out.flush()
 
     def __eq__(self, other):
-        return self.board == other.board and self.stars == other.stars and self.groups == other.groups
+        return (
+                self.star_bits == other.star_bits and
+                self.cross_bits == other.cross_bits and
+                self.section_bits == other.section_bits and
+                self.stars == other.stars and
+                self.groups == other.groups
+        )
 
     def remove_redundant_groups(self):
-        self.groups = [group for group in self.groups if not group.empty()]
-        self.groups = list(set(self.groups))
-
-    def eliminate_tiles(self, tiles):
+        seen = set()
+        groups = []
         for group in self.groups:
-            for tile in tiles:
-                group.remove(tile)
+            if group.empty() or group in seen:
+                self.unindex_group(group)
+                continue
+            seen.add(group)
+            groups.append(group)
+        self.set_groups(groups)
+
+    def eliminate_tiles(self, bits):
+        for index in utils.iter_bits(bits):
+            for group in self.cell_groups[index]:
+                self.record(('group', group, group.bits, group.stars))
+                group.remove(bits)
+                self.changed_bits |= group.bits
+            self.set_cell_groups(index, [])
 
-        for tile in tiles:
-            tile.value = 'x'
+        self.set_masks(self.star_bits & ~bits, self.cross_bits | bits)
 
         self.remove_redundant_groups()
 
-    def place_stars_on_tiles(self, tiles):
-        for tile in tiles:
+    def place_stars_on_tiles(self, bits):
+        for index in utils.iter_bits(bits):
+            tile = self.tiles[index]
             groups = list(self.groups_containing_tile(tile))
-            to_remove = list(self.all_affected(tile)) + [tile]
+            to_remove = self.all_affected(tile) | tile.bit
             for group in groups:
+                self.record(('group', group, group.bits, group.stars))
                 group.stars -= 1
+                if group.stars == 1:
+                    self.changed_bits |= group.bits
             self.eliminate_tiles(to_remove)
-            tile.value = '*'
-
-    def place_star_solved_groups(self):
-        ans = 0
-        star_tiles = set()
-        for group in self.groups:
-            if len(group.tiles) == group.stars:
-                ans += 1
-                star_tiles |= group.tiles
-                self.place_stars_on_tiles(group.tiles.copy())
-        return star_tiles
+            self.set_masks(self.star_bits | tile.bit, self.cross_bits & ~tile.bit)
 
     def apply_2x2_rule(self):
         ans = 0
@@ -213,216 +287,310 @@ class Puzzle:
         for group in self.groups:
             if group.stars == 1:
                 continue
-            groups_2x2 = rules_2x2.get_2x2_groups(group.tiles)
+            groups_2x2 = rules_2x2.get_2x2_groups(group.bits, self.size)
             if len(groups_2x2) == group.stars:
                 ans += 1
                 newgroups = [
-                    Group(tiles, 1) for tiles in groups_2x2
+                    Group(bits, 1) for bits in groups_2x2
                 ]
                 for g in newgroups:
-                    self.groups.append(g)
+                    self.add_group(g)
                 to_remove.append(group)
         for group in to_remove:
-            self.groups.remove(group)
+            self.remove_group(group)
         return ans
 
-    def check_solution_validity(self):
-        section_stars = {string.ascii_lowercase[i]: 0 for i in range(self.size)}
-        row_stars = {r: 0 for r in range(self.size)}
-        col_stars = row_stars.copy()
-        for row in self.board:
-            for tile in row:
-                if tile.empty():
-                    return False
-                elif tile.value == 'x':
-                    continue
-                section_stars[tile.section] += 1
-                row_stars[tile.row] += 1
-                col_stars[tile.col] += 1
-
-        for v in itertools.chain(section_stars.values(), row_stars.values(), col_stars.values()):
-            if v != self.stars:
-                return False
+    def star_count(self, bits):
+        return (self.star_bits & bits).bit_count()
 
-        # TODO: make sure no stars touch
+    # whether star_bits is a full solution: the right number of stars in every row, column and section, none touching
+    def is_solution(self, star_bits):
+        if utils.touching_bits(star_bits, self.size):
+            return False
+        for bits in itertools.chain(self.section_bits.values(), utils.row_masks(self.size), utils.col_masks(self.size)):
+            if (star_bits & bits).bit_count() != self.stars:
+                return False
         return True
 
-    def check_validity(self):
-        section_stars = {string.ascii_lowercase[i]: 0 for i in range(self.size)}
-        row_stars = {r: 0 for r in range(self.size)}
-        col_stars = row_stars.copy()
-        for row in self.board:
-            for tile in row:
-                if tile.value == '*':
-                    section_stars[tile.section] += 1
-                    row_stars[tile.row] += 1
-                    col_stars[tile.col] += 1
-
-        #for v in itertools.chain(section_stars.values(), row_stars.values(), col_stars.values()):
-        #    if v > self.stars:
-        #        return False
-
-        for section in section_stars:
-            if section_stars[section] > self.stars:
-                bg_color = SECTION_BGS[(ord(section) - ord('a')) % len(SECTION_BGS)]
-                return False, f'Too many stars in section \033[48;5;{bg_color}m{section}\033[0m'
-
-        for row in range(self.size):
-            if row_stars[row] > self.stars:
-                return False, f'Too many stars in row {row + 1}'
-
-        for col in range(self.size):
-            if row_stars[col] > self.stars:
-                return False, f'Too many stars in column {col + 1}'
+    # convenience loop calling is_solution on every star mask of boards in turn, nothing is shared between them
+    def check_solutions(self, boards):
+        return [self.is_solution(star_bits) for star_bits in boards]
 
+    def check_solution_validity(self):
+        if self.empty_bits():
+            return False
+        return self.is_solution(self.star_bits)
+
+    def register_groups(self):
+        for group in self.groups:
+            self.known_groups.add(group.bits, group.stars)
+
+    # return the board in the puzzle_state format accepted by __init__
+    def state_string(self):
+        return '\n'.join(
+            ''.join(self.value(tile) for tile in row)
+            for row in self.board
+        )
+
+    # return the section map in the format accepted by __init__
+    def section_string(self):
+        return '\n'.join(
+            ''.join(tile.section for tile in row)
+            for row in self.board
+        )
+
+    # the board and live groups packed into a few hundred bytes, to send to other processes or keep many of around.
+    # see STATE_HEADER for the layout, from_bytes reads it back
+    def to_bytes(self):
+        length = mask_length(self.size)
+        parts = [
+            STATE_HEADER.pack(self.size, self.stars, len(self.groups)),
+            self.section_string().replace('\n', '').encode().translate(LETTER_REGIONS),
+            self.star_bits.to_bytes(length, 'little'),
+            self.cross_bits.to_bytes(length, 'little'),
+        ]
         for group in self.groups:
-            if rules_2x2.get_num_2x2(group.tiles, group.bits) < group.stars:
-                #if group.is_row():
-                #    return False, f'{group.row_number()}'
-                return False, f'Not enough room for stars in group {group}'
+            parts.append(group.bits.to_bytes(length, 'little'))
+            parts.append(GROUP_STARS.pack(group.stars))
+        return b''.join(parts)
+
+    # the puzzle written by to_bytes, data can be any bytes-like object and is read in place
+    @staticmethod
+    def from_bytes(data):
+        data = memoryview(data)
+        size, stars, num_groups = STATE_HEADER.unpack_from(data, 0)
+        offset = STATE_HEADER.size
+        letters = bytes(data[offset:offset + size * size]).translate(REGION_LETTERS).decode()
+        offset += size * size
+        puzzle = Puzzle('\n'.join(letters[row * size:(row + 1) * size] for row in range(size)), None, stars)
+        length = mask_length(size)
+        puzzle.star_bits = int.from_bytes(data[offset:offset + length], 'little')
+        puzzle.cross_bits = int.from_bytes(data[offset + length:offset + 2 * length], 'little')
+        offset += 2 * length
+        for _ in range(num_groups):
+            bits = int.from_bytes(data[offset:offset + length], 'little')
+            group_stars, = GROUP_STARS.unpack_from(data, offset + length)
+            offset += length + GROUP_STARS.size
+            puzzle.add_group(Group(bits, group_stars))
+        return puzzle
 
-        return True, 'Flase eggrt gkole'
+    # max_level caps the multi-group exclusion search, max_guesses caps how many next best groups
+    # can be added in a row without changing the board, max_checks stops trying higher exclusion levels once a step
+    # has made that many checks (None for no limit) and max_nodes bounds the fallback search.
+    # executor is an optional process pool used to probe chains and search exclusions in parallel.
+    # the rules run as stages of a Scheduler, deterministic keeps them in the order they are registered in.
+    # with a checkpoint_path the solver state is saved there every checkpoint_interval seconds,
+    # resume is the progress of a puzzle read back with checkpoint.load
+    def solve(self, interactive=True, max_level=None, max_guesses=None, max_nodes=None, max_checks=DEFAULT_MAX_CHECKS,
+              executor=None, early_exit=False, trace=None, deterministic=False, checkpoint_path=None,
+              checkpoint_interval=checkpoint.DEFAULT_INTERVAL, resume=None):
+        if max_guesses is None:
+            max_guesses = DEFAULT_MAX_GUESSES
+        # per rule timings and counters, trace is an optional file that gets one JSON line per event
+        self.stats = SolveStats(trace)
+        cache_hits = rules_2x2.cache_2x2.hits
+        cache_misses = rules_2x2.cache_2x2.misses
+        # exclusion checks per level and the best next best group found since the board last changed
+        level_checks = {}
+        fallback = None
+
+        # messages are only formatted when there is somewhere to write them
+        verbose = self.out is not None
+
+        def propagate():
+            if verbose:
+                self.log('propagating... ', end='')
+            empty_bits = self.empty_bits()
+            try:
+                num_stars = propagation.propagate(self).bit_count()
+            except propagation.Contradiction as e:
+                if verbose:
+                    self.log(f'contradiction: {e}')
+                raise StopSolve(hit=True)
+            if verbose:
+                self.log(f'{num_stars} stars, {(empty_bits & ~self.empty_bits()).bit_count()} tiles decided')
+            return self.empty_bits() != empty_bits
+
+        def clobber():
+            if verbose:
+                self.log('looking for 2x2 clobbering... ', end='')
+            clobbering = rules_2x2.find_all_2x2_clobbering(self)
+            if verbose:
+                self.log(f'{clobbering.bit_count()} clobbering')
+            if clobbering:
+                self.eliminate_tiles(clobbering)
+            return clobbering != 0
 
-    def update_all_groups(self):
-        for group in self.groups:
-            self.all_groups.add(group.copy())
+        def split_2x2():
+            if verbose:
+                self.log('Applying 2x2 rule...', end='')
+            num_2x2 = self.apply_2x2_rule()
+            if verbose:
+                self.log(f'{num_2x2} groups split')
+                if num_2x2 > 0:
+                    self.log(self.groups)
+            return num_2x2 > 0
+
+        def chains():
+            if verbose:
+                self.log('Looking for chain reactions...', end='')
+            result = apply_chains(self, executor, early_exit)
+            if result and verbose:
+                self.log('Chain found!')
+            return result
+
+        # a level only runs once the level below it found something to check
+        def exclusion(level):
+            def run():
+                nonlocal fallback
+                if level > 1 and not level_checks.get(level - 1):
+                    return None
+                if max_checks is not None and sum(level_checks.values()) >= max_checks:
+                    return None
+                if verbose:
+                    self.log(f'looking for common level {level} multi-group exclusions... ', end='')
+                if executor is None:
+                    exact, level_fallback, checks = multi_group_exclusion.find_exclusion_candidates(level, self, stop_at_exact=True)
+                else:
+                    exact, level_fallback, checks = multi_group_exclusion.find_exclusion_candidates_parallel(
+                        level, self, executor, stop_at_exact=True)
+                level_checks[level] = checks
+                self.stats.add_checks(level, checks)
+                if exact is not None:
+                    stars, disjoint, big = exact
+                    if verbose:
+                        self.log(f'found exclusion in {sum(level_checks.values())} checks')
+                        self.log(stars, disjoint, big)
+                    multi_group_exclusion.apply_exclusion_result(self, stars, disjoint, big)
+                    return True
+                if level_fallback is not None:
+                    value = level_fallback[1].bit_count() - level_fallback[0]
+                    if fallback is None or value < fallback[1].bit_count() - fallback[0]:
+                        fallback = level_fallback
+                if verbose:
+                    self.log(f'{checks} checks')
+                return False
+            return run
 
-    def solve(self):
-        self.init_groups()
-        old_puzzle = self.copy()
+        def next_best():
+            nonlocal guesses
+            if fallback is None or guesses >= max_guesses:
+                return False
+            guesses += 1
+            stars, disjoint, big = fallback
+            if verbose:
+                self.log(f'going with next best: {stars} stars in {disjoint.bit_count()}-tile group')
+                self.log(stars, disjoint, big)
+                self.print_groups([Group(disjoint, stars)])
+            multi_group_exclusion.apply_exclusion_result(self, stars, disjoint, big)
+            return True
+
+        def exhaustive_search():
+            if verbose:
+                self.log('No rules to apply, searching... ', end='')
+            solution = search.search(self, max_nodes)
+            if solution is None:
+                if verbose:
+                    self.log(f'no solution in {search.nodes} nodes, giving up')
+                raise StopSolve()
+            if verbose:
+                self.log(f'found solution in {search.nodes} nodes')
+            self.place_stars_on_tiles(solution)
+            self.eliminate_tiles(self.empty_bits())
+            return True
+
+        # cost guesses follow the old fixed order of the rules, every exclusion level costs ten times the one below
+        scheduler = Scheduler(deterministic, self.stats)
+        scheduler.register('propagation', propagate, cost=0.0001)
+        scheduler.register('clobbering', clobber, cost=0.001)
+        scheduler.register('2x2_split', split_2x2, cost=0.002)
+        scheduler.register('chains', chains, cost=0.01)
+        # no set of disjoint groups is bigger than the board
+        for level in range(1, (max_level or self.size * self.size) + 1):
+            scheduler.register(f'exclusion_{level}', exclusion(level), cost=0.01 * 10 ** min(level, 6),
+                               after=f'exclusion_{level - 1}' if level > 1 else None)
+        scheduler.register('next_best', next_best, fallback=True)
+        scheduler.register('search', exhaustive_search, fallback=True)
+
+        if resume is None:
+            self.init_groups()
+            self.steps = 0
+            guesses = 0
+        else:
+            self.steps = resume['steps']
+            guesses = resume['guesses']
+            scheduler.restore(resume['stages'])
+            for level, checks in resume['level_checks'].items():
+                self.stats.level_checks[int(level)] = checks
+        saved = time.perf_counter()
+
+        # the board before the last step, to reset the guesses once it changes and to highlight the changes
+        old_star_bits = self.star_bits
+        old_cross_bits = self.cross_bits
+        old_puzzle = self.copy() if verbose else None
         while True:
-            self.pretty_print(old_puzzle)
+            if verbose:
+                self.pretty_print(old_puzzle)
             self.remove_redundant_groups()
-            self.update_all_groups()
-            input('Press Enter to step...')
-            old_puzzle = self.copy()
-
-            #print(f'Validity: {self.check_validity()[0]}')
+            self.register_groups()
+            if checkpoint_path is not None and time.perf_counter() - saved >= checkpoint_interval:
+                checkpoint.save(checkpoint_path, self, {
+                    'steps': self.steps,
+                    'guesses': guesses,
+                    'level_checks': self.stats.level_checks,
+                    'stages': scheduler.state(),
+                })
+                saved = time.perf_counter()
+            if interactive:
+                input('Press Enter to step...')
+            if self.star_bits != old_star_bits or self.cross_bits != old_cross_bits:
+                guesses = 0
+            old_star_bits = self.star_bits
+            old_cross_bits = self.cross_bits
+            if verbose:
+                old_puzzle = self.copy()
 
             if len(self.groups) == 0:
-                print('Puzzle is solved with a' + (
-                    'n invalid' if not self.check_solution_validity() else ' valid') + ' solution')
+                if verbose:
+                    self.log('Puzzle is solved with a' + (
+                        'n invalid' if not self.check_solution_validity() else ' valid') + ' solution')
                 break
 
-            print('looking for solved groups... ', end='')
-            num_solved = len(self.place_star_solved_groups())
-            print(f'{num_solved} solved groups')
-            if num_solved > 0:
-                continue
+            self.steps += 1
+            self.stats.steps = self.steps
+            level_checks.clear()
+            fallback = None
+            try:
+                stage = scheduler.step()
+            except StopSolve:
+                break
+            if stage is None:
+                break
 
-            print('looking for 2x2 clobbering... ', end='')
-            clobbering = list(rules_2x2.find_all_2x2_clobbering(self))
-            print(f'{len(clobbering)} clobbering')
-            if len(clobbering) > 0:
-                self.eliminate_tiles(clobbering)
-                continue
+        self.stats.cache_hits = rules_2x2.cache_2x2.hits - cache_hits
+        self.stats.cache_misses = rules_2x2.cache_2x2.misses - cache_misses
 
-            print('Applying 2x2 rule...', end='')
-            num_2x2 = self.apply_2x2_rule()
-            print(f'{num_2x2} groups split')
-            if num_2x2 > 0:
-                print(self.groups)
-                continue
 
-            print('Looking for chain reactions...', end='')
-            result = apply_chains(self)
-            if result:
-                print('Chain found!')
-                continue
+def main(argv=None):
+    import argparse
+    import contextlib
+    from concurrent.futures import ProcessPoolExecutor
+    from loader import load_puzzle
+    parser = argparse.ArgumentParser(description='Solve a puzzle step by step.')
+    parser.add_argument('--probe-jobs', type=int, default=0,
+                        help='worker processes probing chains and searching exclusions in parallel (0 for none)')
+    parser.add_argument('--early-exit', action='store_true',
+                        help=f'take the first chain of at most {SHORT_CHAIN} steps instead of the shortest one')
+    args = parser.parse_args(argv)
 
-            found_exclusion = False
-            total_checks = 0
-            curr_checks = 1
-            level = 1
-            best_value = math.inf
-            best_disjoint = None
-            best_stars = None
-            best_big = None
-            while curr_checks > 0:
-                print(f'looking for common level {level} multi-group exclusions... ', end='')
-                curr_checks = 0
-                stars, disjoint, big, checks = multi_group_exclusion.find_multi_group_exclusions(level, self, common=True, use_2x2=True)
-                curr_checks += checks
-                if stars == 0:
-                    print(f'found exclusion in {total_checks} checks')
-                    found_exclusion = True
-                    print(stars, disjoint, big)
-                    multi_group_exclusion.apply_exclusion_result(self, stars, disjoint, big)
-                    break
-
-                stars, disjoint, big, checks = multi_group_exclusion.find_multi_group_exclusions(level, self, common=True, next_best_thing=True)
-                if stars is not None:
-                    value = len(disjoint) - stars
-                    if value < best_value:
-                        best_value = value
-                        best_disjoint = disjoint
-                        best_big = big
-                        best_stars = stars
-                curr_checks += checks
-                level += 1
-                print(f'{curr_checks} checks')
-                total_checks += curr_checks
-
-            if found_exclusion:
-                continue
-            if best_disjoint is not None:
-                print(f'going with next best: {best_stars} stars in {len(best_disjoint)}-tile group')
-                print(best_stars, best_disjoint, best_big)
-                self.print_groups([Group(best_disjoint, best_stars)])
-                multi_group_exclusion.apply_exclusion_result(self, best_stars, best_disjoint, best_big)
-                continue
-
-            #found = False
-            #for level in range(1, self.size):
-            #    print(f'looking for uncommon level {level} multi-group exclusions... ', end='')
-            #    num_exclusions, checks = multi_group_exclusion.find_multi_group_exclusions(level, self)
-            #    print(f'{num_exclusions} exclusions in {checks} checks')
-            #    if num_exclusions > 0:
-            #        found = True
-            #        break
-            #if found:
-            #    continue
-
-            print("No rules to apply, giving up")
-            break
-
-
-def convert_task(task):
-    from string import ascii_lowercase
-    from math import sqrt
-    nums = list(map(int, task.split(',')))
-    size = round(sqrt(len(nums)))
-    ans = ''
-    for row in range(size):
-        curr_row = ''
-        for col in range(size):
-            curr_row += ascii_lowercase[nums[row * size + col] - 1]
-        ans += curr_row
-        if row != size - 1:
-            ans += '\n'
-
-    return ans
-
-
-def main():
     puzzle_name = input("Enter name of puzzle file without extension: ")
     print(f'Loading puzzle from {puzzle_name}.txt...')
-    with open(f'puzzles/{puzzle_name}.txt') as puzzle_file:
-        puzzle_format = puzzle_file.readline().strip()
-        stars = int(puzzle_file.readline().strip())
-        if puzzle_format == 'online':
-            task = puzzle_file.readline().strip()
-            section_map = convert_task(task)
-        elif puzzle_format == 'original':
-            section_map = [puzzle_file.readline().strip()]
-            remaining = len(section_map[0]) - 1
-            for _ in range(remaining):
-                section_map.append(puzzle_file.readline().strip())
-            section_map = '\n'.join(section_map)
-
-        puzzle = Puzzle(section_map, None, stars)
-        puzzle.solve()
-
-
-main()
-print(f'{len(rules_2x2.cache_2x2.keys())} keys in 2x2 cache')
+    puzzle = load_puzzle(f'puzzles/{puzzle_name}.txt')
+    with ProcessPoolExecutor(args.probe_jobs) if args.probe_jobs else contextlib.nullcontext() as executor:
+        puzzle.solve(executor=executor, early_exit=args.early_exit)
+    print(puzzle.stats)
+    print(f'{len(rules_2x2.cache_2x2)} keys in 2x2 cache')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,33 @@
 import itertools
 import math
-from itertools import combinations, chain
+from concurrent.futures import as_completed
 import rules_2x2
-from group import Group
+from group import Group, GroupRegistry
 
 checks = 0
-considered = 0
+# big groups sent to a worker at a time by find_exclusion_candidates_parallel
+CHUNK_SIZE = 64
 
 
-def multi_group_exclusion_helper(puzzle, current, tile_set, tile_set_bits, remaining_groups, stars, current_stars,
-                                 current_union, current_union_bits, use_2x2=False, next_best_thing=False):
+# seen is a transposition table of (big group bits, small group union, stars still needed) already explored this step,
+# results not better than bound are dropped and branches that can't beat it are cut
+def multi_group_exclusion_helper(puzzle, current, tile_set_bits, remaining_groups, stars, current_stars,
+                                 current_union_bits, seen=None, bound=math.inf):
     global checks
-    if current_stars == stars:
+    if current_stars >= stars:
         return None, None
+    if seen is not None:
+        key = (tile_set_bits, current_union_bits, stars - current_stars)
+        if key in seen:
+            return None, None
+        seen.add(key)
 
     # eliminate all small groups touching existing small groups
     to_remove = []
     for group in remaining_groups:
         if group.bits & current_union_bits != 0:
             to_remove.append(group)
-        elif not use_2x2 and group.bits & tile_set_bits != group.bits:
+        elif group.bits & tile_set_bits != group.bits:
             to_remove.append(group)
     for group in to_remove:
         remaining_groups.remove(group)
@@ -27,47 +35,51 @@ def multi_group_exclusion_helper(puzzle, current, tile_set, tile_set_bits, remai
     best_value = math.inf
     best_stars_out = None
     best_tiles_out = None
-    for group in remaining_groups.copy():
+    candidates = remaining_groups.copy()
+    # only exclusions with 0 stars left count, so the remaining groups must be able to hold the missing stars
+    # and the tiles they can't cover must leave room to beat the bound
+    free_stars = 0
+    free_bits = 0
+    for group in remaining_groups:
+        free_stars += group.stars
+        free_bits |= group.bits
+    if current_stars + free_stars < stars or (tile_set_bits & ~(current_union_bits | free_bits)).bit_count() >= bound:
+        candidates = ()
+
+    for group in candidates:
         if group.stars > stars:
             continue
         checks += 1
 
-        if use_2x2:
-            disjoint = group.tiles - tile_set
-            disjoint_bits = group.bits ^ (group.bits & tile_set_bits)
-            num_2x2 = rules_2x2.get_num_2x2(disjoint, disjoint_bits)
-            stars_in = max(0, group.stars - num_2x2)
-            if stars_in == 0:
-                continue
-        else:
-            stars_in = group.stars
+        union_bits = current_union_bits | group.bits
 
-        current_union |= group.tiles
-
-        total_stars_in = current_stars + stars_in
+        total_stars_in = current_stars + group.stars
         stars_out = stars - total_stars_in
-        tiles_out = tile_set - current_union
-        value = len(tiles_out) - stars_out
-        if ((next_best_thing and value < best_value) or stars_out == 0) and tiles_out != set() and Group(tiles_out, stars_out) not in puzzle.all_groups:
+        tiles_out = tile_set_bits & ~union_bits
+        value = tiles_out.bit_count() - stars_out
+        if stars_out == 0 and value < bound and tiles_out != 0 and not puzzle.known_groups.known(tiles_out, stars_out):
             best_value = value
             best_stars_out = stars_out
             best_tiles_out = tiles_out
 
         remaining_groups.remove(group)
         to_remove.append(group)
-        stars_out, tiles_out = multi_group_exclusion_helper(puzzle, current + [group], tile_set, tile_set_bits,
+        stars_out, tiles_out = multi_group_exclusion_helper(puzzle, current + [group], tile_set_bits,
                                                             remaining_groups,
                                                             stars,
-                                                            total_stars_in, current_union,
-                                                            current_union_bits | group.bits)
+                                                            total_stars_in,
+                                                            union_bits,
+                                                            seen=seen,
+                                                            bound=min(bound, best_value))
         if stars_out is not None and tiles_out is not None:
-            value = len(tiles_out) - stars_out
+            value = tiles_out.bit_count() - stars_out
             if value < best_value:
                 best_value = value
                 best_stars_out = stars_out
                 best_tiles_out = tiles_out
-
-        current_union -= group.tiles
+        # nothing with 0 stars left beats a single tile
+        if best_value <= 1:
+            break
 
     for group in to_remove:
         remaining_groups.add(group)
@@ -76,19 +88,22 @@ def multi_group_exclusion_helper(puzzle, current, tile_set, tile_set_bits, remai
 
 
 def group_union(groups):
-    ans = set()
+    ans = 0
     for group in groups:
-        ans |= group.tiles
+        ans |= group.bits
     return ans
 
 
-def generate_all_big_groups(groups, depth, remaining_groups):
-    for groups in combinations(groups, depth):
-        for group in groups:
-            remaining_groups.remove(group)
-        yield groups
-        for group in groups:
-            remaining_groups.add(group)
+# like combinations, but only yields groups that don't overlap each other
+def disjoint_combinations(groups, depth, start=0, used_bits=0):
+    if depth == 0:
+        yield ()
+        return
+    for i in range(start, len(groups) - depth + 1):
+        group = groups[i]
+        if group.bits & used_bits == 0:
+            for rest in disjoint_combinations(groups, depth - 1, i + 1, used_bits | group.bits):
+                yield (group,) + rest
 
 
 def generate_row_combinations(buckets, depth, last_was_zero, pos):
@@ -102,33 +117,32 @@ def generate_row_combinations(buckets, depth, last_was_zero, pos):
         start = 1
     for i in range(start, len(buckets[pos]) + 1):
         if depth == i:
-            yield from combinations(buckets[pos], i)
+            yield from disjoint_combinations(buckets[pos], i)
         else:
-            yield from itertools.starmap(itertools.chain, itertools.product(combinations(buckets[pos], i),
-                                                                            generate_row_combinations(buckets,
-                                                                                                      depth - i, i == 0,
-                                                                                                      pos + 1)))
+            # product keeps its inputs around and goes over them again, so both sides have to be tuples
+            for first, rest in itertools.product(disjoint_combinations(buckets[pos], i),
+                                                 generate_row_combinations(buckets, depth - i, i == 0, pos + 1)):
+                yield first + rest
 
-def generate_common_big_groups(groups, depth, remaining_groups):
+def generate_common_big_groups(groups, depth, remaining_groups, size):
     rows = set()
     cols = set()
     sections = set()
     for group in groups:
-        if group.is_row():
+        if group.is_row(size):
             rows.add(group)
-        elif group.is_col():
+        elif group.is_col(size):
             cols.add(group)
         else:
             sections.add(group)
+    section_list = [group for group in groups if group in sections]
 
-    num_rows = max(map(lambda x: x.row_number(), groups)) + 1
-    num_cols = max(map(lambda x: x.col_number(), groups)) + 1
-    row_buckets = [[] for _ in range(num_rows)]
-    col_buckets = [[] for _ in range(num_cols)]
+    row_buckets = [[] for _ in range(size)]
+    col_buckets = [[] for _ in range(size)]
     for row in rows:
-        row_buckets[row.row_number()].append(row)
+        row_buckets[row.row_number(size)].append(row)
     for col in cols:
-        col_buckets[col.col_number()].append(col)
+        col_buckets[col.col_number(size)].append(col)
 
     # rows on sections
     remaining_groups -= cols
@@ -148,79 +162,201 @@ def generate_common_big_groups(groups, depth, remaining_groups):
     # sections on rows
     remaining_groups -= cols
     remaining_groups -= sections
-    yield from combinations(sections, depth)
+    yield from disjoint_combinations(section_list, depth)
     remaining_groups |= cols
     remaining_groups |= sections
 
     # sections on cols
     remaining_groups -= rows
     remaining_groups -= sections
-    yield from combinations(sections, depth)
+    yield from disjoint_combinations(section_list, depth)
     remaining_groups |= rows
     remaining_groups |= sections
 
 
-#depth: max number of stars
-def find_multi_group_exclusions(depth, puzzle, common=False, use_2x2=False, next_best_thing=False):
+# first level of multi_group_exclusion_helper for both kinds of search at once.
+# exact results use the 2x2 rule on small groups sticking out of the big group and need 0 stars left over,
+# fallback results only use small groups inside the big group and keep the lowest tiles - stars.
+# only results better than best_exact and best_fallback are returned as (exact_stars, exact_tiles, fallback_stars, fallback_tiles)
+def combined_exclusion_helper(puzzle, tile_set_bits, remaining_groups, stars, stop_at_exact=False, seen=None,
+                              best_exact=math.inf, best_fallback=math.inf):
+    global checks
+    exact_stars = None
+    exact_tiles = None
+    fallback_stars = None
+    fallback_tiles = None
+    for group in list(remaining_groups):
+        if group.stars > stars:
+            continue
+        checks += 1
+
+        contained = group.bits & tile_set_bits == group.bits
+        if contained:
+            stars_in = group.stars
+        else:
+            disjoint_bits = group.bits & ~tile_set_bits
+            stars_in = max(0, group.stars - rules_2x2.get_num_2x2(disjoint_bits, puzzle.size))
+            if stars_in == 0:
+                continue
+
+        stars_out = stars - stars_in
+        tiles_out = tile_set_bits & ~group.bits
+        value = tiles_out.bit_count() - stars_out
+        if tiles_out != 0 and not puzzle.known_groups.known(tiles_out, stars_out):
+            if stars_out == 0 and value < best_exact:
+                best_exact = value
+                exact_stars = stars_out
+                exact_tiles = tiles_out
+            if contained and value < best_fallback:
+                best_fallback = value
+                fallback_stars = stars_out
+                fallback_tiles = tiles_out
+
+        remaining_groups.remove(group)
+        bound = max(best_exact, best_fallback) if contained else best_exact
+        stars_out, tiles_out = multi_group_exclusion_helper(puzzle, [group], tile_set_bits, remaining_groups,
+                                                            stars, stars_in, group.bits, seen=seen, bound=bound)
+        if stars_out is not None and tiles_out is not None:
+            value = tiles_out.bit_count() - stars_out
+            if value < best_exact:
+                best_exact = value
+                exact_stars = stars_out
+                exact_tiles = tiles_out
+            if contained and value < best_fallback:
+                best_fallback = value
+                fallback_stars = stars_out
+                fallback_tiles = tiles_out
+
+        if stop_at_exact and exact_tiles is not None:
+            break
+
+    return exact_stars, exact_tiles, fallback_stars, fallback_tiles
+
+
+# one pass over the common big groups of a level looking for both an exclusion and the next best group.
+# returns (exact, fallback, checks) where exact and fallback are (stars, tiles, big groups) or None
+def find_exclusion_candidates(depth, puzzle, stop_at_exact=False):
     global checks
     checks = 0
 
     remaining_groups = set(puzzle.groups.copy())
-    if common:
-        big_groups = generate_common_big_groups(puzzle.groups, depth, remaining_groups)
-    else:
-        big_groups = generate_all_big_groups(puzzle.groups, depth, remaining_groups)
+    big_groups = generate_common_big_groups(puzzle.groups, depth, remaining_groups, puzzle.size)
 
-    best_value = math.inf
-    best_stars = None
-    best_tiles = None
-    best_big_group = None
+    seen = set()
+    best_exact = math.inf
+    exact = None
+    best_fallback = math.inf
+    fallback = None
     for group_set_big in map(list, big_groups):
-        tile_set_bits = 0
-        tile_set = set()
-        overlapping = False
-        for group in group_set_big:
-            if tile_set_bits & group.bits != 0:
-                overlapping = True
+        tile_set_bits = group_union(group_set_big)
+        big_group_stars = sum((group.stars for group in group_set_big))
+
+        candidates = {group for group in remaining_groups if group.bits & tile_set_bits != 0}
+        exact_stars, exact_tiles, fallback_stars, fallback_tiles = combined_exclusion_helper(
+            puzzle, tile_set_bits, candidates, big_group_stars, stop_at_exact, seen, best_exact, best_fallback)
+        if exact_tiles is not None and exact_tiles.bit_count() - exact_stars < best_exact:
+            best_exact = exact_tiles.bit_count() - exact_stars
+            exact = (exact_stars, exact_tiles, group_set_big)
+            if stop_at_exact:
                 break
-            tile_set_bits |= group.bits
-            tile_set |= group.tiles
-        #TODO: don't generate overlapping groups in the first place
-        if overlapping:
-            continue
+        if fallback_tiles is not None and fallback_tiles.bit_count() - fallback_stars < best_fallback:
+            best_fallback = fallback_tiles.bit_count() - fallback_stars
+            fallback = (fallback_stars, fallback_tiles, group_set_big)
+
+    return exact, fallback, checks
+
+# search a chunk of big groups of a puzzle packed by Puzzle.to_bytes in a worker process.
+# big groups are given as (index, positions of the big groups, positions of the small groups) in puzzle.groups,
+# known is the (bits, stars) of the groups seen so far that lie inside the big groups of the chunk.
+# returns (exact, fallback, checks) where exact and fallback are (value, index, stars, tiles) or None
+def search_big_groups(state, known, chunk, stop_at_exact=False):
+    global checks
+    from main import Puzzle
+    puzzle = Puzzle.from_bytes(state)
+    puzzle.known_groups = GroupRegistry(known, max(len(known), puzzle.known_groups.max_size))
+    checks = 0
+
+    seen = set()
+    exact = None
+    fallback = None
+    for index, big_positions, small_positions in chunk:
+        group_set_big = [puzzle.groups[i] for i in big_positions]
+        tile_set_bits = group_union(group_set_big)
         big_group_stars = sum((group.stars for group in group_set_big))
 
-        to_remove = []
-        for group in remaining_groups:
-            if group.bits & tile_set_bits == 0:
-                to_remove.append(group)
-        for group in to_remove:
-            remaining_groups.remove(group)
-
-        stars, tiles = multi_group_exclusion_helper(puzzle, [], tile_set, tile_set_bits, remaining_groups.copy(),
-                                                    big_group_stars, 0, set(), 0, use_2x2, next_best_thing)
-        if stars is not None and tiles is not None:
-            value = len(tiles) - stars
-            if value < best_value:
-                best_value = value
-                best_stars = stars
-                best_tiles = tiles
-                best_big_group = group_set_big
-
-        for group in to_remove:
-            remaining_groups.add(group)
-
-    # found = 0
-    # for big, small in group_exclusions:
-    #    disjoint = group_union(big) - group_union(small)
-    #    if len(disjoint) > 0:
-    #        found += 1
-    #        print(big, small)
-    #        original_tiles_list = []
-    #        for tile in disjoint:
-    #            original_tiles_list.append(puzzle.board[tile.row][tile.col])
-    #        puzzle.eliminate_tiles(original_tiles_list)
-    return best_stars, best_tiles, best_big_group, checks
+        candidates = {puzzle.groups[i] for i in small_positions}
+        exact_stars, exact_tiles, fallback_stars, fallback_tiles = combined_exclusion_helper(
+            puzzle, tile_set_bits, candidates, big_group_stars, stop_at_exact, seen,
+            math.inf if exact is None else exact[0], math.inf if fallback is None else fallback[0])
+        if exact_tiles is not None:
+            exact = (exact_tiles.bit_count() - exact_stars, index, exact_stars, exact_tiles)
+            if stop_at_exact:
+                break
+        if fallback_tiles is not None:
+            fallback = (fallback_tiles.bit_count() - fallback_stars, index, fallback_stars, fallback_tiles)
+    return exact, fallback, checks
+
+
+# the known (bits, stars) a chunk of big groups can look up: every group an exclusion finds lies inside its big group,
+# so only the keys inside the union of the chunk's big groups are sent instead of the whole registry
+def chunk_known(known, tile_set_bits):
+    union = 0
+    for bits in tile_set_bits:
+        union |= bits
+    return tuple(key for key in known if key[0] & ~union == 0)
+
+
+# same as find_exclusion_candidates with the big groups split across the workers of a process pool.
+# results are merged by (value, index) so they don't depend on the order the workers finish in,
+# with stop_at_exact the first big group with an exclusion wins like in the serial search
+def find_exclusion_candidates_parallel(depth, puzzle, executor, stop_at_exact=False):
+    state = puzzle.to_bytes()
+    known = tuple(puzzle.known_groups)
+    positions = {id(group): i for i, group in enumerate(puzzle.groups)}
+    remaining_groups = set(puzzle.groups)
+    big_groups = generate_common_big_groups(puzzle.groups, depth, remaining_groups, puzzle.size)
+    tasks = []
+    big_bits = []
+    for index, group_set_big in enumerate(map(list, big_groups)):
+        tile_set_bits = group_union(group_set_big)
+        big_bits.append(tile_set_bits)
+        tasks.append((
+            index,
+            tuple(positions[id(group)] for group in group_set_big),
+            tuple(positions[id(group)] for group in remaining_groups if group.bits & tile_set_bits != 0)
+        ))
+    futures = {}
+    for i in range(0, len(tasks), CHUNK_SIZE):
+        chunk = tasks[i:i + CHUNK_SIZE]
+        futures[executor.submit(search_big_groups, state, chunk_known(known, big_bits[i:i + CHUNK_SIZE]), chunk,
+                                stop_at_exact)] = i
+
+    total_checks = 0
+    exacts = []
+    fallbacks = []
+    for future in as_completed(futures):
+        if future.cancelled():
+            continue
+        exact, fallback, chunk_checks = future.result()
+        total_checks += chunk_checks
+        if exact is not None:
+            exacts.append(exact)
+            if stop_at_exact:
+                # chunks after the first exclusion can't change the result
+                for f, start in futures.items():
+                    if start > exact[1]:
+                        f.cancel()
+        if fallback is not None:
+            fallbacks.append(fallback)
+
+    def result(candidates, key):
+        if not candidates:
+            return None
+        _, index, stars, tiles = min(candidates, key=key)
+        return stars, tiles, [puzzle.groups[i] for i in tasks[index][1]]
+
+    exact = result(exacts, (lambda c: c[1]) if stop_at_exact else (lambda c: c[:2]))
+    return exact, result(fallbacks, lambda c: c[:2]), total_checks
 
 def apply_exclusion_result(puzzle, stars, disjoint, big):
     if stars == 0:
@@ -228,11 +364,11 @@ def apply_exclusion_result(puzzle, stars, disjoint, big):
         return
 
     #for group in big:
-    #    if disjoint & group.tiles == disjoint:
+    #    if disjoint & group.bits == disjoint:
     #        for tile in disjoint:
     #            group.remove(tile)
     #            group.stars -= stars
 
-    puzzle.groups.append(
+    puzzle.add_group(
         Group(disjoint, stars)
     )
\ No newline at end of file
@@ -0,0 +1,61 @@
+import string
+
+# Colors & Symbols for grid
+SECTION_BGS = [
+    40, 191, 218, 172, 63, 226, 45, 105, 249, 188
+]
+BLACK = 232
+WHITE = 196
+UNICODE_STAR = "★"
+UNICODE_DOT = "·"
+UNICODE_SQUARE = '■'
+RESET = '\033[0m'
+
+
+def cell(bg_color, text_color, text):
+    return f'\033[48;5;{bg_color}m\033[38;5;{text_color}m{text}'
+
+
+def section_color(section):
+    return SECTION_BGS[(ord(section) - ord('a')) % len(SECTION_BGS)]
+
+
+# the whole board as one string, tiles that changed since old_puzzle are drawn in white
+def render_board(puzzle, old_puzzle=None):
+    lines = [' ' + string.ascii_lowercase[:puzzle.size]]
+    for row in range(puzzle.size):
+        line = [str((row + 1) % 10)]
+        for col in range(puzzle.size):
+            tile = puzzle.board[row][col]
+            value = puzzle.value(tile)
+            is_different = old_puzzle is not None and old_puzzle.value(tile) != value
+            text_color = WHITE if is_different else BLACK
+            if value == 'x':
+                text = UNICODE_DOT
+            elif value == '*':
+                text = '&'
+            else:
+                text = ' '
+            line.append(cell(section_color(tile.section), text_color, text))
+        line.append(RESET)
+        lines.append(''.join(line))
+    return '\n'.join(lines) + '\n'
+
+
+# the board with every tile colored by the first of the groups containing it, labelled with its stars
+def render_groups(puzzle, groups):
+    groups = list(groups)
+    lines = [' ' + string.ascii_lowercase[:puzzle.size]]
+    for row in range(puzzle.size):
+        line = [str((row + 1) % 10)]
+        for col in range(puzzle.size):
+            tile = puzzle.board[row][col]
+            for i, group in enumerate(groups):
+                if group.contains(tile):
+                    line.append(cell(SECTION_BGS[i % len(SECTION_BGS)], WHITE, group.stars % 10))
+                    break
+            else:
+                line.append(cell(BLACK, WHITE, ' '))
+        line.append(RESET)
+        lines.append(''.join(line))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,72 @@
+import rules_2x2
+import utils
+
+
+class Contradiction(Exception):
+    # placed is the mask of stars placed before the contradiction was found
+    def __init__(self, group, placed):
+        super().__init__(f'{group} can\'t be satisfied')
+        self.group = group
+        self.placed = placed
+
+
+# the live groups touching any of the given tiles, each once, in the order of puzzle.cell_groups
+def groups_touching(puzzle, bits):
+    ans = {}
+    for index in utils.iter_bits(bits):
+        for group in puzzle.cell_groups[index]:
+            ans[id(group)] = group
+    return ans
+
+
+# treat every group as "exactly stars of these tiles" and propagate to a fixpoint:
+#  - a group with more stars than fit in its tiles without touching can't be satisfied
+#  - a group with as many tiles as stars gets a star, a group with 0 stars gets its tiles crossed
+#  - the common neighbours of every tile of a one star group can't have a star
+# stars bring their neighbours and the rest of their one star groups with them through place_stars_on_tiles.
+# only the groups touching a changed tile are looked at again. bits is the mask of tiles whose groups start
+# in the queue, all of them by default. returns the mask of stars placed, raises Contradiction
+def propagate(puzzle, bits=None):
+    if bits is None:
+        queue = {id(group): group for group in puzzle.groups}
+    else:
+        queue = groups_touching(puzzle, bits)
+    placed = 0
+    while queue:
+        # oldest first, so short chains of consequences finish before long ones
+        group = queue.pop(next(iter(queue)))
+        num_tiles = group.bits.bit_count()
+        if group.stars > num_tiles or group.stars < 0:
+            raise Contradiction(group, placed)
+        if group.stars > 1 and rules_2x2.get_num_2x2(group.bits, puzzle.size) < group.stars:
+            raise Contradiction(group, placed)
+        # groups dropped as duplicates since they were queued no longer change with the board
+        if num_tiles == 0 or not any(g is group for g in puzzle.cell_groups[(group.bits & -group.bits).bit_length() - 1]):
+            continue
+
+        if group.stars == 0:
+            changed = group.bits
+            woken = groups_touching(puzzle, changed)
+            puzzle.eliminate_tiles(changed)
+        elif group.stars == num_tiles:
+            # one star at a time so stars next to each other show up as a contradiction
+            bit = group.bits & -group.bits
+            tile = puzzle.tiles[bit.bit_length() - 1]
+            changed = puzzle.all_affected(tile) | bit
+            woken = groups_touching(puzzle, changed)
+            puzzle.place_stars_on_tiles(bit)
+            placed |= bit
+        elif group.stars == 1:
+            common = puzzle.full_bits
+            for index in utils.iter_bits(group.bits):
+                common &= puzzle.neighbours[index]
+            changed = common & puzzle.empty_bits()
+            if changed == 0:
+                continue
+            woken = groups_touching(puzzle, changed)
+            puzzle.eliminate_tiles(changed)
+        else:
+            continue
+        woken[id(group)] = group
+        queue.update(woken)
+    return placed
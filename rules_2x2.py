@@ -1,62 +1,153 @@
+from functools import lru_cache
+
+import cover_cache
 import utils
 
-cache_2x2 = {}
+# shapes with a bounding box up to this size are precomputed at import
+SEED_SIDE = 3
+# widest row the exact star count enumerates
+MAX_DP_WIDTH = 10
+# pairs of rows whose compatible options are kept, an entry is up to 144 masks of 144 bits at MAX_DP_WIDTH
+ROW_PAIR_CACHE_SIZE = 1 << 12
+
 class Square:
-    def __init__(self, size, start_tile):
-        self.tiles = {start_tile}
-        self.max = (start_tile.row, start_tile.col)
+    def __init__(self, size, row, col, bit):
+        self.bits = bit
+        self.max = (row, col)
         self.min = self.max
         self.size = size
 
-    def offer(self, tile):
-        new_max = (max(self.max[0], tile.row), max(self.max[1], tile.col))
-        new_min = (min(self.min[0], tile.row), min(self.min[1], tile.col))
+    def offer(self, row, col, bit):
+        new_max = (max(self.max[0], row), max(self.max[1], col))
+        new_min = (min(self.min[0], row), min(self.min[1], col))
         x_diff = new_max[0] - new_min[0]
         y_diff = new_max[1] - new_min[1]
         if x_diff >= self.size or y_diff >= self.size:
             return False
         else:
-            self.tiles.add(tile)
+            self.bits |= bit
             self.min = new_min
             self.max = new_max
             return True
 
-def find_all_2x2_clobbering_helper(puzzle, tiles):
-    # print(tiles)
+def find_all_2x2_clobbering_helper(puzzle, tiles_bits, groups=None):
+    if groups is None:
+        groups = puzzle.groups
     ans = []
-    tiles_bits = utils.bits_from_tiles(tiles)
-    for group in puzzle.groups:
-        disjoint = group.tiles - tiles
-        disjoint_bits = group.bits ^ (group.bits & tiles_bits)
-        num_2x2 = get_num_2x2(disjoint, disjoint_bits)
+    for group in groups:
+        disjoint_bits = group.bits & ~tiles_bits
+        num_2x2 = get_num_2x2(disjoint_bits, puzzle.size)
         if num_2x2 < group.stars:
             ans.append(group)
     return ans
 
-def find_all_2x2_clobbering(puzzle):
-    for row in puzzle.board:
-        for tile in row:
-            if not tile.empty():
-                continue
-            for group in find_all_2x2_clobbering_helper(puzzle, puzzle.all_affected(tile)):
-                yield tile
-                break
+# return a mask of all empty tiles whose star would leave some group without room for its stars.
+# incrementally, tiles found safe by the last pass are only checked again when a group or tile that
+# their star would affect has changed since
+def find_all_2x2_clobbering(puzzle, incremental=True):
+    dirty = puzzle.changed_bits
+    empty = puzzle.empty_bits()
+    recheck = empty & ~puzzle.clobber_clean
+    # a group without room for its stars makes every tile clobber, wherever the change was.
+    # otherwise only the groups overlapping a tile's affected area can be clobbered by it
+    feasible = True
+    for group in puzzle.groups:
+        if get_num_2x2(group.bits, puzzle.size) < group.stars:
+            feasible = False
+            break
+    incremental = incremental and feasible
+
+    ans = 0
+    for index in utils.iter_bits(empty):
+        tile = puzzle.tiles[index]
+        affected = puzzle.all_affected(tile)
+        if incremental and not recheck & tile.bit and not (affected | tile.bit) & dirty:
+            continue
+        groups = None
+        if feasible:
+            groups = {id(group): group for i in utils.iter_bits(affected) for group in puzzle.cell_groups[i]}.values()
+        if find_all_2x2_clobbering_helper(puzzle, affected, groups):
+            ans |= tile.bit
+    puzzle.clobber_clean = empty & ~ans
+    puzzle.changed_bits = 0
+    return ans
 
-def get_num_2x2(tiles, bits):
-    if bits in cache_2x2:
-        return cache_2x2[bits]
-    ans = len(get_2x2_groups(tiles))
-    cache_2x2[bits] = ans
+def count_2x2_groups(bits, size):
+    return len(get_2x2_groups(bits, size))
+
+# every set of non-touching tiles within one row of candidates, as (mask, stars, mask it forbids in the next row)
+@lru_cache(maxsize=None)
+def row_options(candidates):
+    ans = []
+    sub = candidates
+    while True:
+        if sub & (sub >> 1) == 0:
+            ans.append((sub, sub.bit_count(), sub | (sub << 1) | (sub >> 1)))
+        if sub == 0:
+            break
+        sub = (sub - 1) & candidates
+    return tuple(ans)
+
+# for each option of a row, a mask with bit i set when option i of the row above doesn't touch it
+@lru_cache(maxsize=ROW_PAIR_CACHE_SIZE)
+def row_pair(prev_candidates, candidates):
+    prev = row_options(prev_candidates)
+    table = []
+    for _, _, forbidden in row_options(candidates):
+        compatible = 0
+        for i, (option, _, _) in enumerate(prev):
+            if option & forbidden == 0:
+                compatible |= 1 << i
+        table.append(compatible)
+    return tuple(table)
+
+# swap rows and columns of a mask with the given height and row stride
+def transpose(bits, height, width):
+    ans = 0
+    for index in utils.iter_bits(bits):
+        row, col = divmod(index, width)
+        ans |= 1 << (col * height + row)
     return ans
 
-def get_2x2_groups(tiles):
-    tiles = sorted(tiles, key=lambda tile: tile.row + tile.col)
+# maximum number of stars that fit in the mask without touching, by dynamic programming over pairs of rows.
+# the rows run along the narrower side, shapes wider than MAX_DP_WIDTH both ways fall back to the 2x2 cover count
+def max_stars(bits, size):
+    if bits == 0:
+        return 0
+    height, width, bits = cover_cache.normalize(bits, size)
+    if width > height:
+        bits = transpose(bits, height, width)
+        height, width = width, height
+    if width > MAX_DP_WIDTH:
+        return count_2x2_groups(bits, width)
+    row_mask = (1 << width) - 1
+    rows = [(bits >> (r * width)) & row_mask for r in range(height)]
+    best = [stars for _, stars, _ in row_options(rows[0])]
+    for prev_candidates, candidates in zip(rows, rows[1:]):
+        table = row_pair(prev_candidates, candidates)
+        best = [
+            stars + max(best[i] for i in utils.iter_bits(compatible))
+            for (_, stars, _), compatible in zip(row_options(candidates), table)
+        ]
+    return max(best)
+
+# upper bound on the number of stars the mask can hold
+def get_num_2x2(bits, size):
+    return cache_2x2.lookup(bits, size, max_stars)
+
+# return a list of masks, each fitting in a 2x2 square, that together cover the given mask
+def get_2x2_groups(bits, size):
+    indices = sorted(utils.iter_bits(bits), key=lambda index: index // size + index % size)
     squares = []
-    for tile in tiles:
+    for index in indices:
+        row, col = divmod(index, size)
         for square in squares:
-            if square.offer(tile):
+            if square.offer(row, col, 1 << index):
                 break
         else:
-            squares.append(Square(2, tile))
-    ans = [s.tiles for s in squares]
+            squares.append(Square(2, row, col, 1 << index))
+    ans = [s.bits for s in squares]
     return ans
+
+cache_2x2 = cover_cache.CoverCache()
+cache_2x2.seed(max_stars, SEED_SIDE)
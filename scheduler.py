@@ -0,0 +1,93 @@
+import time
+
+
+# raised by a stage to end the solve, hit is what gets recorded for the stage that raised it
+class StopSolve(Exception):
+    def __init__(self, hit=False):
+        super().__init__()
+        self.hit = hit
+
+
+# a rule the solver can run. run() returns True when it made progress, False when it didn't and None when it
+# doesn't apply right now. cost is a guess of the seconds one call takes, used until there are measurements.
+# a stage with after set is never ordered before the stage of that name, fallback stages only run in
+# registration order once every other stage came up empty
+class Stage:
+    def __init__(self, name, run, cost=0.001, after=None, fallback=False):
+        self.name = name
+        self.run = run
+        self.cost = cost
+        self.after = after
+        self.fallback = fallback
+        self.calls = 0
+        self.hits = 0
+        self.time = 0.0
+
+    # expected seconds per deduction, the cost guess counts as one more call that hit
+    def score(self):
+        return (self.time + self.cost) / (self.hits + 1)
+
+
+# runs the registered stages of a solve until one of them makes progress.
+# stages that found the most per second so far go first, in deterministic mode they run in registration order
+class Scheduler:
+    def __init__(self, deterministic=False, stats=None):
+        self.stages = []
+        self.deterministic = deterministic
+        self.stats = stats
+
+    def register(self, name, run, cost=0.001, after=None, fallback=False):
+        stage = Stage(name, run, cost, after, fallback)
+        self.stages.append(stage)
+        return stage
+
+    # the measurements of every stage that ran as {name: [calls, hits, time]}, see restore
+    def state(self):
+        return {stage.name: [stage.calls, stage.hits, stage.time] for stage in self.stages if stage.calls}
+
+    # continue from measurements saved by state, stages that aren't registered any more are ignored
+    def restore(self, state):
+        for stage in self.stages:
+            if stage.name in state:
+                stage.calls, stage.hits, stage.time = state[stage.name]
+                if self.stats is not None:
+                    stats = self.stats.rules[stage.name]
+                    stats.calls, stats.hits, stats.time = stage.calls, stage.hits, stage.time
+
+    def order(self):
+        if self.deterministic:
+            return list(self.stages)
+        rules = [stage for stage in self.stages if not stage.fallback]
+        keys = {}
+        for stage in rules:
+            key = stage.score()
+            if stage.after is not None:
+                key = max(key, keys[stage.after])
+            keys[stage.name] = key
+        # sorted is stable, so ties keep the registration order
+        return sorted(rules, key=lambda stage: keys[stage.name]) + [stage for stage in self.stages if stage.fallback]
+
+    def record(self, stage, hit, elapsed):
+        stage.calls += 1
+        stage.time += elapsed
+        if hit:
+            stage.hits += 1
+        if self.stats is not None:
+            self.stats.record(stage.name, hit, elapsed)
+
+    # run stages in order until one makes progress, returns that stage or None when none did.
+    # StopSolve from a stage is passed on after recording it
+    def step(self):
+        for stage in self.order():
+            start = time.perf_counter()
+            try:
+                hit = stage.run()
+            except StopSolve as e:
+                self.record(stage, e.hit, time.perf_counter() - start)
+                raise
+            if hit is None:
+                continue
+            self.record(stage, hit, time.perf_counter() - start)
+            if hit:
+                return stage
+        return None
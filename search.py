@@ -0,0 +1,197 @@
+import time
+
+import rules_2x2
+import utils
+
+nodes = 0
+
+
+class SearchLimitReached(Exception):
+    pass
+
+
+# place stars and remove candidates until every group is consistent, returns (candidates, stars) or None on a contradiction.
+# with the board size, groups needing more than one star are also checked against the 2x2 count of their candidates
+# and tiles next to every candidate of a group needing one star are removed
+def propagate(groups, neighbours, candidates, stars, size=None, dirty=None):
+    # only groups touching a tile that changed since they were last looked at can change, dirty is the tiles changed
+    # by the caller, None for all
+    if dirty is None:
+        dirty = -1
+    while dirty:
+        current = dirty
+        dirty = 0
+        for bits, group_stars in groups:
+            if bits & current == 0:
+                continue
+            need = group_stars - (stars & bits).bit_count()
+            if need < 0:
+                return None
+            free = candidates & bits
+            num_free = free.bit_count()
+            if num_free < need:
+                return None
+            if size is not None and need > 1 and num_free > need and rules_2x2.get_num_2x2(free, size) < need:
+                return None
+            before = candidates
+            if need == 0:
+                candidates &= ~free
+            elif num_free == need:
+                for index in utils.iter_bits(free):
+                    bit = 1 << index
+                    if candidates & bit == 0:
+                        # an earlier star in this group was next to this tile
+                        return None
+                    stars |= bit
+                    candidates &= ~(bit | neighbours[index])
+            elif need == 1 and size is not None:
+                # a tile next to every candidate of the group would leave it without a star
+                common = candidates
+                for index in utils.iter_bits(free):
+                    common &= neighbours[index]
+                    if common == 0:
+                        break
+                candidates &= ~common
+            dirty |= before & ~candidates
+    return candidates, stars
+
+
+# return the candidates of the unsatisfied group with the fewest candidates per missing star,
+# or 0 if every group is satisfied
+def most_constrained(groups, candidates, stars):
+    best = 0
+    best_count = None
+    best_need = 1
+    for bits, group_stars in groups:
+        need = group_stars - (stars & bits).bit_count()
+        if need == 0:
+            continue
+        free = candidates & bits
+        count = free.bit_count()
+        if best_count is None or count * best_need < best_count * need:
+            best = free
+            best_count = count
+            best_need = need
+    return best
+
+
+def dfs(groups, neighbours, candidates, stars, max_nodes, size=None, dirty=None):
+    global nodes
+    nodes += 1
+    if max_nodes is not None and nodes > max_nodes:
+        raise SearchLimitReached()
+
+    result = propagate(groups, neighbours, candidates, stars, size, dirty)
+    if result is None:
+        return None
+    candidates, stars = result
+
+    free = most_constrained(groups, candidates, stars)
+    if free == 0:
+        return stars
+
+    bit = free & -free
+    index = bit.bit_length() - 1
+    ans = dfs(groups, neighbours, candidates & ~(bit | neighbours[index]), stars | bit, max_nodes, size,
+              bit | neighbours[index])
+    if ans is not None:
+        return ans
+    return dfs(groups, neighbours, candidates & ~bit, stars, max_nodes, size, bit)
+
+
+# like dfs, but keeps going after a solution and adds every one to solutions until there are limit of them
+def count_dfs(groups, neighbours, candidates, stars, max_nodes, size, limit, solutions, dirty=None):
+    global nodes
+    nodes += 1
+    if max_nodes is not None and nodes > max_nodes:
+        raise SearchLimitReached()
+
+    result = propagate(groups, neighbours, candidates, stars, size, dirty)
+    if result is None:
+        return
+    candidates, stars = result
+
+    free = most_constrained(groups, candidates, stars)
+    if free == 0:
+        solutions.append(stars)
+        return
+
+    bit = free & -free
+    index = bit.bit_length() - 1
+    count_dfs(groups, neighbours, candidates & ~(bit | neighbours[index]), stars | bit, max_nodes, size, limit,
+              solutions, bit | neighbours[index])
+    if limit is None or len(solutions) < limit:
+        count_dfs(groups, neighbours, candidates & ~bit, stars, max_nodes, size, limit, solutions, bit)
+
+
+# find a placement of stars on the empty tiles satisfying every live group.
+# returns the mask of new stars, or None if there is no solution or max_nodes was exceeded
+def search(puzzle, max_nodes=None):
+    global nodes
+    nodes = 0
+    groups = [(group.bits, group.stars) for group in puzzle.groups]
+    candidates = puzzle.empty_bits()
+    for index in utils.iter_bits(puzzle.star_bits):
+        candidates &= ~puzzle.neighbours[index]
+    try:
+        return dfs(groups, puzzle.neighbours, candidates, 0, max_nodes, puzzle.size)
+    except SearchLimitReached:
+        return None
+
+
+# the row, column and section groups of a puzzle as (bits, stars) with every tile in them,
+# stars already on the board count towards them
+def board_groups(puzzle):
+    masks = list(utils.row_masks(puzzle.size)) + list(utils.col_masks(puzzle.size)) + list(puzzle.section_bits.values())
+    return [(bits, puzzle.stars) for bits in masks]
+
+
+# find up to limit solutions of the puzzle from the stars and crosses on its board, ignoring its groups.
+# returns the list of solutions as star masks, or None if max_nodes was exceeded first.
+# the nodes needed grow fast with the board, see the README for measured times
+def count_solutions(puzzle, limit=2, max_nodes=None):
+    global nodes
+    nodes = 0
+    candidates = puzzle.empty_bits()
+    for index in utils.iter_bits(puzzle.star_bits):
+        candidates &= ~puzzle.neighbours[index]
+    solutions = []
+    try:
+        count_dfs(board_groups(puzzle), puzzle.neighbours, candidates, puzzle.star_bits, max_nodes, puzzle.size,
+                  limit, solutions)
+    except SearchLimitReached:
+        return None
+    return solutions
+
+
+def main():
+    import argparse
+    from batch import find_puzzles
+    from main import Puzzle
+
+    parser = argparse.ArgumentParser(description='Count the solutions of puzzles.')
+    parser.add_argument('paths', nargs='+', help='puzzle files, directories or glob patterns')
+    parser.add_argument('-n', '--limit', type=int, default=2, help='stop counting at this many solutions (0 for all)')
+    parser.add_argument('--max-nodes', type=int, default=None, help='give up after this many search nodes')
+    args = parser.parse_args()
+
+    for name, spec in find_puzzles(args.paths):
+        if isinstance(spec, Exception):
+            print(f'{name}\terror:{type(spec).__name__}: {spec}')
+            continue
+        section_map, stars, state = spec
+        start = time.perf_counter()
+        try:
+            puzzle = Puzzle(section_map, state, stars)
+        except Exception as e:
+            print(f'{name}\terror:{type(e).__name__}: {e}')
+            continue
+        solutions = count_solutions(puzzle, args.limit or None, args.max_nodes)
+        elapsed = time.perf_counter() - start
+        count = 'unknown' if solutions is None else len(solutions)
+        if solutions is not None and args.limit and len(solutions) >= args.limit:
+            count = f'{count}+'
+        print(f'{name}\t{count}\t{nodes} nodes\t{elapsed:.3f}s')
+
+if __name__ == '__main__':
+    main()
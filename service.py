@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import SolveTimeout, init_worker, raise_timeout, solution_status
+from loader import convert_task, parse_state
+from main import DEFAULT_MAX_CHECKS, Puzzle
+
+# extra seconds the service waits for a worker past a request's own timeout before giving up on it
+TIMEOUT_GRACE = 5
+
+
+# the section map of a request: "regions" with rows separated by newlines or /, or a star-battles.com "task"
+def request_section_map(request):
+    if 'task' in request:
+        return convert_task(request['task'])
+    return request['regions'].replace('/', '\n')
+
+
+# the seconds a request may take as a positive float, None for no limit
+def request_timeout(timeout):
+    if timeout is None:
+        return None
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float, str)):
+        raise ValueError(f'timeout must be a number of seconds, got {timeout!r}')
+    seconds = float(timeout)
+    if not 0 < seconds < math.inf:
+        raise ValueError(f'timeout must be a positive number of seconds, got {timeout!r}')
+    return seconds
+
+
+# solve one request in a worker process, returning the response without the id
+def solve_request(request):
+    start = time.perf_counter()
+    timeout = None
+    puzzle = None
+    try:
+        timeout = request_timeout(request.get('timeout'))
+        if timeout:
+            signal.signal(signal.SIGALRM, raise_timeout)
+            # setitimer takes fractions of a second, unlike alarm
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        section_map = request_section_map(request)
+        state = request.get('state')
+        if state:
+            state = parse_state(state, section_map.count('\n') + 1)
+        puzzle = Puzzle(section_map, state, int(request['stars']))
+        puzzle.out = None
+        puzzle.solve(interactive=False, max_level=request.get('max_level'), max_guesses=request.get('max_guesses'),
+                     max_nodes=request.get('max_nodes'), max_checks=request.get('max_checks', DEFAULT_MAX_CHECKS),
+                     deterministic=request.get('deterministic', False))
+        status = solution_status(puzzle)
+    except SolveTimeout:
+        status = 'timeout'
+    except Exception as e:
+        status = f'error:{type(e).__name__}: {e}'
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    response = {'status': status, 'time': time.perf_counter() - start}
+    if puzzle is not None:
+        response['steps'] = getattr(puzzle, 'steps', 0)
+        response['solution'] = puzzle.state_string().replace('\n', '/')
+    return response
+
+
+def warm_up():
+    return os.getpid()
+
+
+# solves puzzles from JSON lines on a pool of warm worker processes.
+# at most max_pending requests are in flight, reading stops until one of them finishes
+class SolveService:
+    def __init__(self, jobs, max_pending, timeout=None, max_level=None, cover_cache=None, max_guesses=None,
+                 max_nodes=None, max_checks=DEFAULT_MAX_CHECKS):
+        self.executor = ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(cover_cache,))
+        self.jobs = jobs
+        self.pending = asyncio.Semaphore(max_pending)
+        self.timeout = timeout
+        self.max_level = max_level
+        self.max_guesses = max_guesses
+        self.max_nodes = max_nodes
+        self.max_checks = max_checks
+
+    # start every worker now so the first requests don't pay for process startup and the 2x2 cache
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, warm_up) for _ in range(self.jobs)))
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def solve(self, request):
+        request = dict(request)
+        request.setdefault('timeout', self.timeout)
+        request.setdefault('max_level', self.max_level)
+        request.setdefault('max_guesses', self.max_guesses)
+        request.setdefault('max_nodes', self.max_nodes)
+        request.setdefault('max_checks', self.max_checks)
+        timeout = request['timeout'] = request_timeout(request['timeout'])
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, solve_request, request)
+        try:
+            return await asyncio.wait_for(future, timeout + TIMEOUT_GRACE if timeout else None)
+        except asyncio.TimeoutError:
+            return {'status': 'timeout', 'time': timeout}
+
+    async def handle(self, line, write):
+        try:
+            try:
+                request = json.loads(line)
+                request_id = request.get('id')
+            except (ValueError, AttributeError) as e:
+                write({'id': None, 'status': f'error:bad request: {e}'})
+                return
+            # every request gets a response, whatever goes wrong solving it
+            try:
+                response = await self.solve(request)
+            except Exception as e:
+                response = {'status': f'error:{type(e).__name__}: {e}'}
+            write({'id': request_id, **response})
+        finally:
+            self.pending.release()
+
+    # answer every request read from reader, responses are written in the order they finish
+    async def serve(self, reader, write):
+        tasks = set()
+        while True:
+            await self.pending.acquire()
+            line = await reader.readline()
+            if not line:
+                self.pending.release()
+                break
+            if not line.strip():
+                self.pending.release()
+                continue
+            task = asyncio.create_task(self.handle(line, write))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+
+# reads lines in a thread, so stdin can be a file as well as a pipe or terminal
+class StdinReader:
+    async def readline(self):
+        return await asyncio.get_running_loop().run_in_executor(None, sys.stdin.buffer.readline)
+
+
+async def serve_stdin(service):
+    reader = StdinReader()
+
+    def write(response):
+        sys.stdout.write(json.dumps(response) + '\n')
+        sys.stdout.flush()
+
+    await service.serve(reader, write)
+
+
+async def serve_tcp(service, host, port):
+    async def connection(reader, writer):
+        def write(response):
+            writer.write((json.dumps(response) + '\n').encode())
+
+        try:
+            await service.serve(reader, write)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(connection, host, port)
+    print(f'listening on {", ".join(str(sock.getsockname()) for sock in server.sockets)}', file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+async def run(args):
+    service = SolveService(args.jobs, args.max_pending, args.timeout, args.max_level, args.cover_cache,
+                           args.max_guesses, args.max_nodes, args.max_checks or None)
+    try:
+        await service.start()
+        if args.port is None:
+            await serve_stdin(service)
+        else:
+            await serve_tcp(service, args.host, args.port)
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Solve puzzles sent as JSON lines on stdin or a TCP socket.')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='requests in flight before reading stops (default: twice the jobs)')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='default seconds allowed per puzzle')
+    parser.add_argument('-l', '--max-level', type=int, default=None,
+                        help='default highest multi-group exclusion level to try before searching')
+    parser.add_argument('--max-guesses', type=int, default=None,
+                        help='default next best groups to add while the board stays the same before searching')
+    parser.add_argument('--max-checks', type=int, default=DEFAULT_MAX_CHECKS,
+                        help='default exclusion checks in one step before searching instead, 0 for no limit')
+    parser.add_argument('--max-nodes', type=int, default=None,
+                        help='default search nodes before giving up on the fallback search')
+    parser.add_argument('--cover-cache', help='precomputed 2x2 cover cache file to load in every worker')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on with --port')
+    parser.add_argument('--port', type=int, default=None, help='listen on this TCP port instead of reading stdin')
+    args = parser.parse_args(argv)
+    if args.max_pending is None:
+        args.max_pending = 2 * args.jobs
+
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
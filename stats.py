@@ -0,0 +1,68 @@
+import json
+from collections import defaultdict
+
+
+class RuleStats:
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self.time = 0.0
+
+    def to_dict(self):
+        return {'calls': self.calls, 'hits': self.hits, 'time': self.time}
+
+
+# counters collected over one solve: per rule calls, hits and time, multi-group exclusion checks per level
+# and 2x2 cache hits. every event is also written as a JSON line to trace when one is given
+class SolveStats:
+    def __init__(self, trace=None):
+        self.rules = defaultdict(RuleStats)
+        self.level_checks = defaultdict(int)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.steps = 0
+        self.trace = trace
+
+    def write_trace(self, **event):
+        if self.trace is not None:
+            self.trace.write(json.dumps(event) + '\n')
+
+    def record(self, rule, hit, elapsed):
+        stats = self.rules[rule]
+        stats.calls += 1
+        stats.time += elapsed
+        if hit:
+            stats.hits += 1
+        self.write_trace(step=self.steps, rule=rule, hit=bool(hit), time=elapsed)
+
+    def add_checks(self, level, checks):
+        self.level_checks[level] += checks
+        self.write_trace(step=self.steps, rule='exclusion_level', level=level, checks=checks)
+
+    @property
+    def checks(self):
+        return sum(self.level_checks.values())
+
+    @property
+    def cache_hit_rate(self):
+        total = self.cache_hits + self.cache_misses
+        return self.cache_hits / total if total else 0.0
+
+    def to_dict(self):
+        return {
+            'steps': self.steps,
+            'rules': {rule: stats.to_dict() for rule, stats in self.rules.items()},
+            'level_checks': dict(self.level_checks),
+            'checks': self.checks,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_hit_rate': self.cache_hit_rate,
+        }
+
+    def __str__(self):
+        lines = [f'{self.steps} steps, {self.checks} checks, 2x2 cache hit rate {self.cache_hit_rate:.1%}']
+        for rule, stats in self.rules.items():
+            lines.append(f'  {rule}: {stats.hits}/{stats.calls} hits in {stats.time:.3f}s')
+        for level, checks in sorted(self.level_checks.items()):
+            lines.append(f'  level {level}: {checks} checks')
+        return '\n'.join(lines)
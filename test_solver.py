@@ -0,0 +1,326 @@
+import asyncio
+import itertools
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import batch
+import checkpoint
+import multi_group_exclusion
+import rules_2x2
+import search
+import service
+import utils
+from group import Group
+from generator import random_section_map
+from loader import iter_binary, load_puzzle, parse_line, write_binary
+from main import Puzzle
+from scheduler import Scheduler
+
+
+# a random board of the given size whose regions hold `stars` stars of a valid solution
+def random_puzzle(size, stars, seed):
+    return Puzzle(random_section_map(size, stars, random.Random(seed))[0], None, stars)
+
+
+def snapshot(puzzle):
+    return (
+        puzzle.star_bits,
+        puzzle.cross_bits,
+        puzzle.changed_bits,
+        [(group.bits, group.stars) for group in puzzle.groups],
+        [[id(group) for group in groups] for groups in puzzle.cell_groups],
+    )
+
+
+# the most stars that fit in bits with no two touching, found the slow way
+def brute_max_stars(bits, size):
+    indices = list(utils.iter_bits(bits))
+    neighbours = utils.neighbour_masks(size)
+    for count in range(len(indices), 0, -1):
+        for chosen in itertools.combinations(indices, count):
+            if all(neighbours[a] & (1 << b) == 0 for a, b in itertools.combinations(chosen, 2)):
+                return count
+    return 0
+
+
+def brute_solutions(puzzle):
+    size = puzzle.size
+    solutions = []
+    for cols in itertools.permutations(range(size)):
+        star_bits = 0
+        for row, col in enumerate(cols):
+            star_bits |= 1 << (row * size + col)
+        if puzzle.is_solution(star_bits):
+            solutions.append(star_bits)
+    return solutions
+
+
+def test_init_groups_are_rows_columns_and_sections():
+    puzzle = load_puzzle('puzzles/6x6_1.txt')
+    puzzle.out = None
+    puzzle.init_groups()
+    masks = set(utils.row_masks(puzzle.size)) | set(utils.col_masks(puzzle.size)) | set(puzzle.section_bits.values())
+    assert {group.bits for group in puzzle.groups} == masks
+    assert all(group.stars == puzzle.stars for group in puzzle.groups)
+    for index, groups in enumerate(puzzle.cell_groups):
+        assert all(group.bits >> index & 1 for group in groups)
+        assert len(groups) == 3
+
+
+@pytest.mark.parametrize('name', ['5x5_1', '6x6_2', '8x8_1', '10x10_5'])
+def test_solves_to_a_valid_solution(name):
+    puzzle = load_puzzle(f'puzzles/{name}.txt')
+    puzzle.out = None
+    puzzle.solve(interactive=False, deterministic=True)
+    assert puzzle.empty_bits() == 0
+    assert puzzle.is_solution(puzzle.star_bits)
+    assert puzzle.star_bits.bit_count() == puzzle.size * puzzle.stars
+
+
+def test_search_takes_over_when_the_checks_run_out():
+    puzzle = load_puzzle('puzzles/10x10_4.txt')
+    puzzle.out = None
+    puzzle.solve(interactive=False, deterministic=True, max_checks=0)
+    assert puzzle.check_solution_validity()
+    assert puzzle.stats.to_dict()['checks'] == 0
+    assert puzzle.stats.rules['search'].hits == 1
+
+
+def test_rollback_restores_the_puzzle():
+    puzzle = load_puzzle('puzzles/6x6_1.txt')
+    puzzle.out = None
+    puzzle.init_groups()
+    before = snapshot(puzzle)
+    groups = list(puzzle.groups)
+
+    mark = puzzle.push()
+    tile = puzzle.tiles[next(utils.iter_bits(puzzle.empty_bits()))]
+    puzzle.add_group(Group(tile.bit, 1))
+    puzzle.place_stars_on_tiles(tile.bit)
+    puzzle.apply_2x2_rule()
+    assert snapshot(puzzle) != before
+    puzzle.rollback(mark)
+
+    assert snapshot(puzzle) == before
+    assert all(a is b for a, b in zip(puzzle.groups, groups))
+    assert puzzle.trail is None
+
+
+@pytest.mark.parametrize('size', [4, 5, 12])
+def test_max_stars_matches_brute_force(size):
+    rng = random.Random(size)
+    for _ in range(200):
+        # keep the masks small enough to brute force
+        bits = 0
+        for index in rng.sample(range(size * size), rng.randint(1, 11)):
+            bits |= 1 << index
+        assert rules_2x2.max_stars(bits, size) == brute_max_stars(bits, size)
+
+
+@pytest.mark.parametrize('name', ['10x10_1', '10x10_4'])
+def test_incremental_clobbering_matches_a_full_pass(name, monkeypatch):
+    find_all = rules_2x2.find_all_2x2_clobbering
+    calls = []
+
+    def checked(puzzle):
+        changed, clean = puzzle.changed_bits, puzzle.clobber_clean
+        full = find_all(puzzle, incremental=False)
+        puzzle.changed_bits, puzzle.clobber_clean = changed, clean
+        ans = find_all(puzzle)
+        calls.append(ans)
+        assert ans == full
+        return ans
+
+    monkeypatch.setattr(rules_2x2, 'find_all_2x2_clobbering', checked)
+    puzzle = load_puzzle(f'puzzles/{name}.txt')
+    puzzle.out = None
+    puzzle.solve(interactive=False, deterministic=True)
+    assert puzzle.check_solution_validity()
+    assert len(calls) > 1 and any(calls)
+
+
+def test_big_groups_are_whole_and_disjoint():
+    puzzle = load_puzzle('puzzles/10x10_4.txt')
+    puzzle.out = None
+    puzzle.init_groups()
+    puzzle.apply_2x2_rule()
+    for depth in range(1, puzzle.size + 1):
+        remaining = set(puzzle.groups)
+        for big in multi_group_exclusion.generate_common_big_groups(puzzle.groups, depth, remaining, puzzle.size):
+            assert len(big) == depth
+            assert sum(len(group) for group in big) == multi_group_exclusion.group_union(big).bit_count()
+        assert remaining == set(puzzle.groups)
+
+
+def test_parallel_exclusion_search_matches_the_serial_one(monkeypatch):
+    find_candidates = multi_group_exclusion.find_exclusion_candidates
+    found = []
+
+    def key(result):
+        return None if result is None else (result[0], result[1], [group.bits for group in result[2]])
+
+    def checked(depth, puzzle, stop_at_exact=False):
+        ans = find_candidates(depth, puzzle, stop_at_exact)
+        for stop in (False, True):
+            exact, fallback, checks = find_candidates(depth, puzzle, stop)
+            parallel_exact, parallel_fallback, parallel_checks = multi_group_exclusion.find_exclusion_candidates_parallel(
+                depth, puzzle, executor, stop)
+            assert key(parallel_exact) == key(exact)
+            if not stop:
+                assert key(parallel_fallback) == key(fallback)
+                assert parallel_checks == checks
+        found.append(ans[0])
+        return ans
+
+    monkeypatch.setattr(multi_group_exclusion, 'find_exclusion_candidates', checked)
+    with ProcessPoolExecutor(2) as executor:
+        puzzle = load_puzzle('puzzles/10x10_2.txt')
+        puzzle.out = None
+        puzzle.solve(interactive=False, deterministic=True)
+    assert puzzle.check_solution_validity()
+    assert any(found)
+
+
+def test_binary_round_trip(tmp_path):
+    puzzles = [
+        ('ab\nab', 1, None),
+        ('aab\nabb\nccc', 1, '*x.\n...\n..x'),
+        (random_puzzle(8, 1, 0).section_string(), 1, None),
+    ]
+    path = str(tmp_path / 'puzzles.bin')
+    assert write_binary(path, puzzles) == len(puzzles)
+    assert list(iter_binary(path)) == puzzles
+
+
+def test_parse_line():
+    assert parse_line('2 aabb *x..\n') == ('aa\nbb', 2, '*x\n..')
+    assert parse_line('1 1,1,2,2') == ('aa\nbb', 1, None)
+    with pytest.raises(ValueError):
+        parse_line('1 aabbc')
+
+
+@pytest.mark.parametrize('line', ['1 1,1,2,2,3', '1 1,1,2,0', '1 1,1,2,27'])
+def test_parse_line_rejects_bad_tasks(line):
+    with pytest.raises(ValueError):
+        parse_line(line)
+
+
+class LineReader:
+    def __init__(self, lines):
+        self.lines = [line.encode() + b'\n' for line in lines]
+
+    async def readline(self):
+        return self.lines.pop(0) if self.lines else b''
+
+
+def test_service_answers_every_request():
+    regions = load_puzzle('puzzles/5x5_1.txt').section_string().replace('\n', '/')
+    lines = [
+        json.dumps({'id': 1, 'stars': 1, 'regions': regions}),
+        '',
+        json.dumps({'id': 2, 'stars': 1, 'task': '1,1,2,2'}),
+        json.dumps({'id': 3, 'stars': 1, 'task': '1,1,2'}),
+        json.dumps({'id': 4, 'stars': 1, 'regions': regions, 'timeout': -1}),
+        'not json',
+    ]
+    responses = []
+
+    async def serve():
+        solver = service.SolveService(1, 2)
+        try:
+            await solver.start()
+            await solver.serve(LineReader(lines), responses.append)
+        finally:
+            solver.close()
+
+    asyncio.run(serve())
+    by_id = {response['id']: response for response in responses}
+    assert len(responses) == 5
+    assert by_id[1]['status'] == 'valid'
+    assert '.' not in by_id[1]['solution'] and by_id[1]['solution'].count('*') == 5
+    assert by_id[2]['status'] == 'unsolved'
+    assert by_id[3]['status'].startswith('error:ValueError')
+    assert by_id[4]['status'].startswith('error:ValueError')
+    assert by_id[None]['status'].startswith('error:bad request')
+
+
+def test_count_solutions_matches_brute_force():
+    for seed in range(30):
+        puzzle = random_puzzle(5, 1, seed)
+        expected = brute_solutions(puzzle)
+        assert sorted(search.count_solutions(puzzle, limit=None)) == sorted(expected)
+        assert len(search.count_solutions(puzzle, limit=1)) == min(1, len(expected))
+
+
+@pytest.mark.parametrize('size', [1, 2, 5, 10])
+def test_touching_bits_matches_neighbours(size):
+    rng = random.Random(size)
+    neighbours = utils.neighbour_masks(size)
+    for _ in range(200):
+        bits = rng.getrandbits(size * size)
+        touching = any(neighbours[index] & bits for index in utils.iter_bits(bits))
+        assert (utils.touching_bits(bits, size) != 0) == touching
+
+
+def test_bytes_round_trip():
+    puzzle = load_puzzle('puzzles/10x10_1.txt')
+    puzzle.out = None
+    puzzle.init_groups()
+    puzzle.eliminate_tiles(rules_2x2.find_all_2x2_clobbering(puzzle))
+    puzzle.apply_2x2_rule()
+
+    copy = Puzzle.from_bytes(puzzle.to_bytes())
+    assert copy == puzzle
+    assert copy.section_string() == puzzle.section_string()
+    assert copy.to_bytes() == puzzle.to_bytes()
+    for index, groups in enumerate(copy.cell_groups):
+        assert [(g.bits, g.stars) for g in groups] == [(g.bits, g.stars) for g in puzzle.cell_groups[index]]
+
+
+def test_scheduler_order_keeps_after_and_fallback_stages_in_place():
+    scheduler = Scheduler()
+    cheap = scheduler.register('cheap', lambda: False, cost=0.001)
+    exact = scheduler.register('search', lambda: False, cost=0.0001, fallback=True)
+    level_1 = scheduler.register('level_1', lambda: False, cost=0.01)
+    level_2 = scheduler.register('level_2', lambda: False, cost=0.0001, after='level_1')
+    medium = scheduler.register('medium', lambda: False, cost=0.005)
+    guess = scheduler.register('guess', lambda: False, cost=0.0001, fallback=True)
+    # a cheaper level 2 still waits for level 1, fallbacks come last in registration order
+    assert scheduler.order() == [cheap, medium, level_1, level_2, exact, guess]
+
+    # level 1 got cheaper per deduction than cheap, level 2 follows it without passing it
+    level_1.hits = 100
+    assert scheduler.order() == [level_1, level_2, cheap, medium, exact, guess]
+
+    scheduler.deterministic = True
+    assert scheduler.order() == scheduler.stages
+
+
+def test_checkpoint_round_trip(tmp_path):
+    puzzle = load_puzzle('puzzles/10x10_2.txt')
+    puzzle.out = None
+    puzzle.init_groups()
+    puzzle.register_groups()
+    progress = {'steps': 3, 'guesses': 1, 'level_checks': {'2': 40}, 'stages': {}}
+    path = str(tmp_path / 'puzzle.checkpoint')
+    checkpoint.save(path, puzzle, progress)
+
+    loaded, loaded_progress = checkpoint.load(path, puzzle.section_string(), puzzle.stars)
+    assert loaded == puzzle
+    assert loaded_progress == progress
+    assert list(loaded.known_groups) == list(puzzle.known_groups)
+
+    other = load_puzzle('puzzles/10x10_3.txt')
+    with pytest.raises(ValueError):
+        checkpoint.load(path, other.section_string(), other.stars)
+    with pytest.raises(ValueError):
+        checkpoint.load(path, puzzle.section_string(), puzzle.stars + 1)
+
+
+def test_checkpoint_files_are_named_by_full_path():
+    names = ['a/p.txt', 'b/p.txt', 'a/list.txt:1', 'a/list.txt:2']
+    paths = {batch.puzzle_file_path('checkpoints', name, '.checkpoint') for name in names}
+    assert len(paths) == len(names)
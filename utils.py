@@ -1,5 +1,60 @@
+from functools import lru_cache
+
+
 def bits_from_tiles(tiles):
     bits = 0
     for tile in tiles:
         bits |= tile.bit
     return bits
+
+
+# yield the index of every set bit, lowest first
+def iter_bits(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+@lru_cache(maxsize=None)
+def neighbour_masks(size):
+    masks = []
+    for row in range(size):
+        for col in range(size):
+            mask = 0
+            for row_offset in range(-1, 2):
+                for col_offset in range(-1, 2):
+                    r = row + row_offset
+                    c = col + col_offset
+                    if row_offset == 0 and col_offset == 0:
+                        continue
+                    if 0 <= r < size and 0 <= c < size:
+                        mask |= 1 << (c + r * size)
+            masks.append(mask)
+    return tuple(masks)
+
+
+@lru_cache(maxsize=None)
+def row_masks(size):
+    row = (1 << size) - 1
+    return tuple(row << (r * size) for r in range(size))
+
+
+@lru_cache(maxsize=None)
+def col_masks(size):
+    col = 0
+    for r in range(size):
+        col |= 1 << (r * size)
+    return tuple(col << c for c in range(size))
+
+
+# the stars of bits with another star of bits to their right, below them or diagonally below them,
+# 0 when no two stars touch. shifts the whole board at once instead of looking at every star's neighbours
+def touching_bits(bits, size):
+    cols = col_masks(size)
+    return bits & (
+        (bits >> 1 & ~cols[-1])
+        | (bits >> size)
+        | (bits >> (size + 1) & ~cols[-1])
+        | (bits >> (size - 1) & ~cols[0])
+    )